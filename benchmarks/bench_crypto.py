@@ -0,0 +1,43 @@
+# coding: utf-8
+"""
+    benchmarks.bench_crypto
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import os
+
+import pytest
+
+from flask.ext.relief.crypto import (
+    xor_bytes, mask_secret, unmask_secret, constant_time_equal
+)
+
+
+SIZES = [20, 64, 1024]
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_xor_bytes(benchmark, size):
+    benchmark(xor_bytes, os.urandom(size), os.urandom(size))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('size', SIZES)
+def test_mask_secret(benchmark, size, compact):
+    benchmark(mask_secret, u'a' * size, compact=compact)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('size', SIZES)
+def test_unmask_secret(benchmark, size, compact):
+    benchmark(unmask_secret, mask_secret(u'a' * size, compact=compact))
+
+
+@pytest.mark.parametrize('equal', [True, False])
+@pytest.mark.parametrize('size', SIZES)
+def test_constant_time_equal(benchmark, size, equal):
+    a = u'a' * size
+    b = a if equal else u'b' * size
+    benchmark(constant_time_equal, a, b)
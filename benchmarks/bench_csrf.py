@@ -0,0 +1,22 @@
+# coding: utf-8
+"""
+    benchmarks.bench_csrf
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import pytest
+
+from flask.ext.relief.csrf import generate_csrf_token, TokenReservoir
+
+
+@pytest.mark.parametrize('length', [20, 64])
+def test_generate_csrf_token(benchmark, length):
+    benchmark(generate_csrf_token, length=length)
+
+
+def test_token_reservoir_get(benchmark):
+    reservoir = TokenReservoir(size=100000)
+    reservoir.fill()
+    benchmark(reservoir.get)
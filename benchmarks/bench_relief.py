@@ -0,0 +1,65 @@
+# coding: utf-8
+"""
+    benchmarks.bench_relief
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import flask
+import pytest
+
+from flask.ext.relief import Relief, WebForm, Text
+
+
+class BoundRelief(Relief):
+    def get_csrf_binding(self):
+        return flask.request.remote_addr
+
+
+@pytest.mark.parametrize('config', [
+    None, 'RELIEF_CSRF_STATELESS', 'RELIEF_CSRF_DOUBLE_SUBMIT'
+])
+def test_get_post_cycle(benchmark, app, config):
+    if config is not None:
+        app.config[config] = True
+    BoundRelief(app)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        if flask.request.method == 'GET':
+            return flask.render_template_string(u'{{ csrf_token }}')
+        return u'success'
+
+    client = app.test_client()
+
+    def cycle():
+        csrf_token = client.get('/').data
+        response = client.post('/', data={'csrf_token': csrf_token})
+        assert response.status_code == 200
+
+    benchmark(cycle)
+
+
+@pytest.mark.parametrize('fields', [5, 50, 500])
+def test_set_and_validate_on_submit(benchmark, app, fields):
+    names = ['field%d' % i for i in range(fields)]
+    Form = type('Form', (WebForm, ), dict((name, Text) for name in names))
+    data = dict((name, u'value') for name in names)
+
+    with app.test_request_context(method='POST', data=data):
+        # Parse the form once, we are not interested in werkzeug's parser.
+        flask.request.form
+
+        def submit():
+            assert Form().set_and_validate_on_submit()
+
+        benchmark(submit)
+
+
+@pytest.mark.parametrize('fields', [5, 50, 500])
+def test_instantiate_form(benchmark, fields):
+    Form = type('Form', (WebForm, ), dict(
+        ('field%d' % i, Text) for i in range(fields)
+    ))
+    benchmark(Form)
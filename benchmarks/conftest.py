@@ -0,0 +1,18 @@
+# coding: utf-8
+"""
+    benchmarks.conftest
+    ~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import pytest
+from flask import Flask
+
+
+@pytest.fixture
+def app():
+    app = Flask('__main__')
+    app.config['SECRET_KEY'] = b'secret'
+    app.testing = True
+    return app
@@ -0,0 +1,229 @@
+# coding: utf-8
+"""
+    benchmarks.loadtest
+    ~~~~~~~~~~~~~~~~~~~
+
+    Measures the overhead of Relief under concurrent load, by serving a plain
+    reference application and one protected by Relief and driving both with
+    the same number of concurrent clients. Each client repeatedly gets a page
+    with a form and submits it.
+
+    Run it from the root of the repository::
+
+        python benchmarks/loadtest.py --clients 8 --flows 200
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from __future__ import division, print_function
+import re
+import sys
+import time
+import socket
+import argparse
+import threading
+from multiprocessing import Process
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+
+import flask
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from flask.ext.relief import Relief, WebForm, Text
+
+
+FIELDS = ['field%d' % i for i in range(10)]
+
+TEMPLATE = u'''
+<form method="post">
+  <input type="hidden" name="csrf_token" value="{{ csrf_token }}">
+  {% for field in fields %}<input name="{{ field }}">{% endfor %}
+</form>
+'''
+
+CSRF_TOKEN_RE = re.compile(br'name="csrf_token" value="([^"]*)"')
+
+
+Form = type('Form', (WebForm, ), dict((field, Text) for field in FIELDS))
+
+
+def make_plain_app():
+    app = flask.Flask(__name__)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        if flask.request.method == 'GET':
+            return flask.render_template_string(
+                TEMPLATE, csrf_token=u'', fields=FIELDS
+            )
+        if all(flask.request.form.get(field) for field in FIELDS):
+            return u'success'
+        return u'failure', 400
+    return app
+
+
+def make_relief_app():
+    app = flask.Flask(__name__)
+    app.config['SECRET_KEY'] = b'secret'
+    Relief(app)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        if flask.request.method == 'GET':
+            return flask.render_template_string(TEMPLATE, fields=FIELDS)
+        if Form().set_and_validate_on_submit():
+            return u'success'
+        return u'failure', 400
+    return app
+
+
+APPLICATIONS = [('plain', make_plain_app), ('relief', make_relief_app)]
+
+
+def get_free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(make_app, port):
+    server = make_server(
+        '127.0.0.1', port, make_app(), threaded=True,
+        request_handler=QuietRequestHandler
+    )
+    server.serve_forever()
+
+
+def wait_for_server(port, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run_flow(connection, cookie):
+    # Gets the form and submits it, returns the cookie to use for the next
+    # flow.
+    headers = {'Cookie': cookie} if cookie else {}
+    connection.request('GET', '/', headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    set_cookie = response.getheader('Set-Cookie')
+    if set_cookie:
+        cookie = set_cookie.split(';', 1)[0]
+    csrf_token = CSRF_TOKEN_RE.search(body).group(1)
+
+    data = dict((field, u'value') for field in FIELDS)
+    data['csrf_token'] = csrf_token
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if cookie:
+        headers['Cookie'] = cookie
+    connection.request('POST', '/', urlencode(data), headers)
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError('submission failed with %d' % response.status)
+    return cookie
+
+
+def run_client(port, flows, latencies):
+    connection = HTTPConnection('127.0.0.1', port)
+    cookie = None
+    try:
+        for _ in range(flows):
+            start = time.time()
+            cookie = run_flow(connection, cookie)
+            latencies.append(time.time() - start)
+    finally:
+        connection.close()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100 * (len(values) - 1)))]
+
+
+def load_test(make_app, clients, flows):
+    """
+    Serves the application returned by `make_app` in a separate process and
+    runs `flows` flows with each of the given number of concurrent `clients`.
+    Returns the throughput in flows per second, the median and the 99th
+    percentile of the latency in seconds.
+    """
+    port = get_free_port()
+    process = Process(target=serve, args=(make_app, port))
+    process.start()
+    try:
+        wait_for_server(port)
+        latencies = []
+        threads = [
+            threading.Thread(target=run_client, args=(port, flows, latencies))
+            for _ in range(clients)
+        ]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.time() - start
+    finally:
+        process.terminate()
+        process.join()
+    if len(latencies) != clients * flows:
+        raise RuntimeError('not all flows completed')
+    return (
+        len(latencies) / duration,
+        percentile(latencies, 50),
+        percentile(latencies, 99)
+    )
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Measures the overhead of Relief under concurrent load.'
+    )
+    parser.add_argument(
+        '--clients', type=int, default=8, help='number of concurrent clients'
+    )
+    parser.add_argument(
+        '--flows', type=int, default=100, help='GET and POST flows per client'
+    )
+    arguments = parser.parse_args(argv)
+
+    results = {}
+    print(u'%-8s %12s %10s %10s' % (u'app', u'flows/s', u'p50 ms', u'p99 ms'))
+    for name, make_app in APPLICATIONS:
+        results[name] = throughput, p50, p99 = load_test(
+            make_app, arguments.clients, arguments.flows
+        )
+        print(u'%-8s %12.1f %10.2f %10.2f' % (
+            name, throughput, p50 * 1000, p99 * 1000
+        ))
+    plain, relief = results['plain'], results['relief']
+    print(u'%-8s %+11.1f%% %+10.2f %+10.2f' % (
+        u'overhead',
+        (relief[0] - plain[0]) / plain[0] * 100,
+        (relief[1] - plain[1]) * 1000,
+        (relief[2] - plain[2]) * 1000
+    ))
+
+
+if __name__ == '__main__':
+    main()
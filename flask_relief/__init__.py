@@ -7,14 +7,42 @@
     :license: BSD, see LICENSE.rst for details
 """
 import sys
+import random
+from copy import copy
 
 import relief
 from relief.validation import ProbablyAnEmailAddress
-from flask import request, abort, session, Blueprint
+from flask import (
+    request, abort, session, g, Blueprint, current_app, _request_ctx_stack
+)
+from werkzeug.datastructures import MultiDict, OrderedMultiDict
 
-from flask.ext.relief.csrf import touch_csrf_token
+from flask.ext.relief._compat import (
+    implements_to_string, dict_iteritems, iterlists, OrderedDict
+)
+from flask.ext.relief.csrf import (
+    generate_csrf_token, touch_csrf_token, TokenReservoir,
+    generate_signed_csrf_token, check_signed_csrf_token, unmask_csrf_token,
+    dump_cookie_csrf_token, load_cookie_csrf_token, normalize_origin,
+    is_trusted_origin, SIGNED_CSRF_TOKEN_LENGTH
+)
 from flask.ext.relief.crypto import (
-    constant_time_equal, mask_secret, unmask_secret
+    constant_time_equal, mask_secret, mask_secrets, unmask_secret
+)
+from flask.ext.relief.streaming import peek_form_field
+if sys.version_info >= (3, 5):
+    from flask.ext.relief.asyncsupport import (
+        AsyncReliefMixin, AsyncWebFormMixin
+    )
+else:
+    class AsyncReliefMixin(object):
+        pass
+
+    class AsyncWebFormMixin(object):
+        pass
+from flask.ext.relief.metrics import (
+    Metrics, Stopwatch, record_csrf_check, record_form_submission,
+    add_server_timings, format_server_timing
 )
 
 
@@ -25,62 +53,668 @@ blueprint = Blueprint(
 )
 
 
-class Relief(object):
+@implements_to_string
+class LazyCSRFToken(object):
+    """
+    Stands in for the masked CSRF token in templates. The token is only looked
+    up and masked, when this object is rendered.
+    """
+    def __init__(self, extension):
+        self.extension = extension
+
+    def __str__(self):
+        stopwatch = Stopwatch()
+        masked_csrf_token = mask_secret(
+            self.extension.get_csrf_token(),
+            compact=current_app.config['RELIEF_CSRF_COMPACT_TOKENS']
+        )
+        stopwatch.lap('token')
+        add_server_timings('csrf', stopwatch.timings)
+        return masked_csrf_token
+
+    def __html__(self):
+        return self.__str__()
+
+
+class Relief(AsyncReliefMixin):
     # Methods that are defined by RFC 2616 to be safe and should not cause any
     # actions beside retrieval of information.
     CSRF_SAFE_METHODS = frozenset(['GET', 'HEAD'])
 
+    #: Policies that determine how the CSRF token is checked for an endpoint,
+    #: see :meth:`csrf_policy`.
+    CSRF_POLICIES = frozenset(['default', 'exempt', 'header-only', 'form-only'])
+    if sys.version_info >= (3, 5):
+        CSRF_POLICIES |= frozenset(['async'])
+
+    #: Values of ``RELIEF_CSRF_ORIGIN_CHECK``, see :meth:`init_app`.
+    CSRF_ORIGIN_CHECKS = frozenset([None, 'strict', 'allow'])
+
+    # Mimetypes of request bodies that may contain a CSRF token.
+    CSRF_FORM_MIMETYPES = frozenset([
+        'application/x-www-form-urlencoded', 'multipart/form-data'
+    ])
+
     def __init__(self, app=None):
+        self.token_reservoir = None
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app):
+        """
+        Sets up CSRF protection for `app`.
+
+        Before the token is checked, the origin of a request can be compared
+        to the origin of the application and those in
+        ``RELIEF_CSRF_TRUSTED_ORIGINS``, e.g. ``'https://example.com'``. The
+        origin is taken from the ``Origin`` header or, if that is missing,
+        from the ``Referer``. ``RELIEF_CSRF_ORIGIN_CHECK`` determines what
+        happens based on the result:
+
+        `None`
+            The origin is not checked, this is the default.
+
+        `'strict'`
+            Requests from an untrusted origin are rejected, without looking
+            at the token.
+
+        `'allow'`
+            Requests from a trusted origin are accepted, without looking at
+            the token.
+
+        Requests that carry neither header are always checked as usual.
+
+        If ``RELIEF_CSRF_STATELESS`` is set, tokens are signed instead of
+        being stored. Such a token would be valid for every client, so
+        :meth:`get_csrf_binding` has to be overridden to use this mode.
+
+        If ``RELIEF_SERVER_TIMING`` is set, the time spent on the stages of the
+        CSRF check, on rendering the token and on binding and validating
+        :class:`WebForm` instances is made available as ``g.relief_timings``
+        and sent in a ``Server-Timing`` header. Only the given fraction
+        ``RELIEF_SERVER_TIMING_SAMPLE_RATE`` of requests is timed.
+        """
+        app.config.setdefault('RELIEF_CSRF_COMPACT_TOKENS', False)
+        app.config.setdefault('RELIEF_CSRF_TOKEN_RESERVOIR_SIZE', 0)
+        app.config.setdefault('RELIEF_CSRF_STATELESS', False)
+        app.config.setdefault('RELIEF_CSRF_TOKEN_MAX_AGE', 3600)
+        app.config.setdefault('RELIEF_CSRF_DOUBLE_SUBMIT', False)
+        app.config.setdefault('RELIEF_CSRF_COOKIE_NAME', 'relief_csrf_token')
+        app.config.setdefault('RELIEF_CSRF_COOKIE_HTTPONLY', True)
+        app.config.setdefault('RELIEF_CSRF_POLICIES', {})
+        app.config.setdefault('RELIEF_CSRF_BLUEPRINT_POLICIES', {})
+        app.config.setdefault('RELIEF_CSRF_HEADER_FIRST', False)
+        app.config.setdefault('RELIEF_CSRF_MAX_FORM_CONTENT_LENGTH', None)
+        app.config.setdefault('RELIEF_CSRF_STREAMING', False)
+        app.config.setdefault('RELIEF_CSRF_STREAMING_LIMIT', 4096)
+        app.config.setdefault('RELIEF_CSRF_ORIGIN_CHECK', None)
+        app.config.setdefault('RELIEF_CSRF_TRUSTED_ORIGINS', [])
+        app.config.setdefault('RELIEF_METRICS', False)
+        app.config.setdefault('RELIEF_SERVER_TIMING', False)
+        app.config.setdefault('RELIEF_SERVER_TIMING_SAMPLE_RATE', 1.0)
+        app.config.setdefault('RELIEF_METRICS_URL', None)
+        app.config.setdefault('RELIEF_METRICS_DIR', None)
+        if app.config['RELIEF_CSRF_STATELESS'] and \
+                type(self).get_csrf_binding == Relief.get_csrf_binding:
+            raise ValueError(
+                'stateless csrf tokens require get_csrf_binding to be '
+                'overridden'
+            )
+        app.extensions['relief'] = self
+        app.extensions['relief_csrf_policies'] = {}
+        origin_check = app.config['RELIEF_CSRF_ORIGIN_CHECK']
+        if origin_check not in self.CSRF_ORIGIN_CHECKS:
+            raise ValueError('unknown csrf origin check: %r' % origin_check)
+        app.extensions['relief_trusted_origins'] = frozenset(
+            normalize_origin(origin)
+            for origin in app.config['RELIEF_CSRF_TRUSTED_ORIGINS']
+        )
+        if app.config['RELIEF_METRICS']:
+            app.extensions['relief_metrics'] = Metrics(
+                directory=app.config['RELIEF_METRICS_DIR']
+            )
+            if app.config['RELIEF_METRICS_URL'] is not None:
+                app.add_url_rule(
+                    app.config['RELIEF_METRICS_URL'], 'relief_metrics',
+                    self._render_metrics
+                )
+        if app.config['RELIEF_CSRF_TOKEN_RESERVOIR_SIZE']:
+            self.token_reservoir = TokenReservoir(
+                size=app.config['RELIEF_CSRF_TOKEN_RESERVOIR_SIZE']
+            )
         app.context_processor(self._inject_csrf_token)
+        app.before_first_request(self._resolve_csrf_policies)
+        if app.config['RELIEF_SERVER_TIMING']:
+            app.before_request(self._start_server_timing)
+            app.after_request(self._add_server_timing_header)
+        if app.config['RELIEF_CSRF_DOUBLE_SUBMIT']:
+            app.after_request(self._update_csrf_cookie)
         app.before_request(self._check_csrf_token)
         app.register_blueprint(blueprint)
 
+    def csrf_policy(self, policy):
+        """
+        Returns a decorator that sets the CSRF `policy` for a view function or
+        for all endpoints of a :class:`~flask.Blueprint`. `policy` is one of:
+
+        `'default'`
+            The token is taken from the form or the ``X-RELIEF-CSRF-Token``
+            header.
+
+        `'exempt'`
+            The token is not checked at all, neither the session nor the body
+            of the request are accessed.
+
+        `'header-only'`
+            The token is only taken from the header, the body of the request
+            is never parsed.
+
+        `'form-only'`
+            The token is only taken from the form.
+
+        `'async'`
+            The token is not checked before the request is dispatched, the
+            view has to await :meth:`check_csrf_token_async` instead, which
+            takes the token from the form or the header without blocking the
+            event loop. Only available on Python 3.5 and later.
+
+        Policies can also be configured with the ``RELIEF_CSRF_POLICIES`` and
+        ``RELIEF_CSRF_BLUEPRINT_POLICIES`` mappings of endpoint and blueprint
+        names to policies. The policy of an endpoint is the first one found
+        in ``RELIEF_CSRF_POLICIES``, set on the view function, in
+        ``RELIEF_CSRF_BLUEPRINT_POLICIES`` and set on the blueprint, in that
+        order.
+        """
+        if policy not in self.CSRF_POLICIES:
+            raise ValueError('unknown csrf policy: %r' % policy)
+
+        def decorator(view_or_blueprint):
+            view_or_blueprint.relief_csrf_policy = policy
+            return view_or_blueprint
+        return decorator
+
+    def exempt(self, view_or_blueprint):
+        """
+        Exempts a view function or a blueprint from CSRF checking.
+        """
+        return self.csrf_policy('exempt')(view_or_blueprint)
+
     def reset_csrf_token(self):
-        del session['_csrf_token']
+        context = _request_ctx_stack.top
+        context.relief_csrf_token = None
+        # Stateless tokens cannot be revoked, short of changing the binding or
+        # the secret key.
+        if current_app.config['RELIEF_CSRF_STATELESS']:
+            return
+        if current_app.config['RELIEF_CSRF_DOUBLE_SUBMIT']:
+            context.relief_csrf_cookie = None
+        else:
+            session.pop('_csrf_token', None)
+
+    def get_csrf_binding(self):
+        """
+        Returns a string stateless CSRF tokens are bound to, so that they are
+        only valid for a specific client. Override this to return e.g. the id
+        of the logged in user, this is required to use stateless tokens.
+        """
+        raise NotImplementedError(
+            'stateless csrf tokens require get_csrf_binding to be overridden'
+        )
+
+    def get_csrf_token(self):
+        """
+        Returns the unmasked CSRF token for the current request. In the default
+        mode the token is created and stored in the session, if it does not
+        exist yet.
+
+        If ``RELIEF_CSRF_DOUBLE_SUBMIT`` is set, the token is stored in a
+        signed cookie of its own called ``RELIEF_CSRF_COOKIE_NAME`` instead,
+        so that the session is not needed for CSRF protection. Submitted
+        tokens are compared to the one in the cookie.
+
+        Tokens are only created, when they are asked for by a template or a
+        view. Requests using a safe method do not access the session at all.
+
+        The token is looked up once per request.
+        """
+        context = _request_ctx_stack.top
+        csrf_token = getattr(context, 'relief_csrf_token', None)
+        if csrf_token is None:
+            if current_app.config['RELIEF_CSRF_STATELESS']:
+                csrf_token = generate_signed_csrf_token(
+                    current_app.secret_key, self.get_csrf_binding()
+                )
+            elif current_app.config['RELIEF_CSRF_DOUBLE_SUBMIT']:
+                # After a reset the cookie of the request still holds the
+                # revoked token.
+                if hasattr(context, 'relief_csrf_cookie'):
+                    csrf_token = None
+                else:
+                    csrf_token = self._load_cookie_csrf_token()
+                if csrf_token is None:
+                    csrf_token = self._generate_csrf_token()
+                    context.relief_csrf_cookie = csrf_token
+            else:
+                csrf_token = touch_csrf_token(
+                    generate=self._generate_csrf_token
+                )
+            context.relief_csrf_token = csrf_token
+        return csrf_token
+
+    def _generate_csrf_token(self):
+        if self.token_reservoir is None:
+            return generate_csrf_token()
+        return self.token_reservoir.get()
+
+    def _load_cookie_csrf_token(self):
+        name = current_app.config['RELIEF_CSRF_COOKIE_NAME']
+        value = request.cookies.get(name)
+        if not value:
+            return None
+        return load_cookie_csrf_token(value, current_app.secret_key)
+
+    def _update_csrf_cookie(self, response):
+        # Sets the cookie to the token created during this request or deletes
+        # it, if the token has been reset.
+        context = _request_ctx_stack.top
+        if not hasattr(context, 'relief_csrf_cookie'):
+            return response
+        config = current_app.config
+        session_interface = current_app.session_interface
+        name = config['RELIEF_CSRF_COOKIE_NAME']
+        domain = session_interface.get_cookie_domain(current_app)
+        path = session_interface.get_cookie_path(current_app)
+        if context.relief_csrf_cookie is None:
+            response.delete_cookie(name, domain=domain, path=path)
+        else:
+            response.set_cookie(
+                name,
+                dump_cookie_csrf_token(
+                    context.relief_csrf_cookie, current_app.secret_key
+                ),
+                domain=domain, path=path,
+                secure=session_interface.get_cookie_secure(current_app),
+                httponly=config['RELIEF_CSRF_COOKIE_HTTPONLY']
+            )
+        return response
+
+    def _start_server_timing(self):
+        sample_rate = current_app.config['RELIEF_SERVER_TIMING_SAMPLE_RATE']
+        if random.random() < sample_rate:
+            g.relief_timings = {}
+
+    def _add_server_timing_header(self, response):
+        server_timings = getattr(g, 'relief_timings', None)
+        if server_timings:
+            response.headers.add(
+                'Server-Timing', format_server_timing(server_timings)
+            )
+        return response
 
     def _inject_csrf_token(self):
-        return {'csrf_token': mask_secret(touch_csrf_token())}
+        return {'csrf_token': LazyCSRFToken(self)}
+
+    def _resolve_csrf_policy(self, app, endpoint):
+        # Static files, whether served by the app or by a blueprint, never
+        # change any state. They are recognized by their view, a view that
+        # just happens to be called static is checked as usual.
+        view = app.view_functions.get(endpoint)
+        if _is_static_view(app, view):
+            return 'exempt'
+        policy = app.config['RELIEF_CSRF_POLICIES'].get(endpoint)
+        if policy is None:
+            policy = getattr(view, 'relief_csrf_policy', None)
+        if policy is None and '.' in endpoint:
+            blueprint_name = endpoint.rsplit('.', 1)[0]
+            policy = app.config['RELIEF_CSRF_BLUEPRINT_POLICIES'].get(
+                blueprint_name
+            )
+            if policy is None:
+                policy = getattr(
+                    app.blueprints.get(blueprint_name), 'relief_csrf_policy',
+                    None
+                )
+        if policy is None:
+            return 'default'
+        if policy not in self.CSRF_POLICIES:
+            raise ValueError('unknown csrf policy: %r' % policy)
+        return policy
+
+    def _resolve_csrf_policies(self):
+        app = current_app._get_current_object()
+        policies = app.extensions['relief_csrf_policies']
+        for endpoint in app.view_functions:
+            policies[endpoint] = self._resolve_csrf_policy(app, endpoint)
+
+    def get_endpoint_csrf_policy(self, app, endpoint):
+        """
+        Returns the CSRF policy of the given `endpoint` of `app`, see
+        :meth:`csrf_policy`.
+        """
+        policies = app.extensions['relief_csrf_policies']
+        try:
+            return policies[endpoint]
+        except KeyError:
+            # Endpoints added after the first request was dispatched.
+            policy = policies[endpoint] = self._resolve_csrf_policy(
+                app, endpoint
+            )
+            return policy
+
+    def _get_csrf_policy(self):
+        endpoint = request.endpoint
+        if endpoint is None:
+            return 'default'
+        return self.get_endpoint_csrf_policy(current_app, endpoint)
+
+    def _may_parse_form(self):
+        max_length = current_app.config['RELIEF_CSRF_MAX_FORM_CONTENT_LENGTH']
+        if max_length is None:
+            return True
+        # Without a Content-Length, e.g. for chunked requests, the length of
+        # the body is unknown and may exceed the limit.
+        content_length = request.content_length
+        return content_length is not None and content_length <= max_length
+
+    def _peek_masked_csrf_token(self):
+        # The body can only be peeked at, as long as nobody has started reading
+        # it yet.
+        if not current_app.config['RELIEF_CSRF_STREAMING'] or \
+                'stream' in request.__dict__ or 'form' in request.__dict__:
+            return None
+        return peek_form_field(
+            request.environ, 'csrf_token',
+            limit=current_app.config['RELIEF_CSRF_STREAMING_LIMIT']
+        )
+
+    def _get_masked_csrf_token(self, policy):
+        use_header = policy != 'form-only'
+        use_form = policy != 'header-only'
+        if use_header and (
+            current_app.config['RELIEF_CSRF_HEADER_FIRST'] or not use_form
+        ):
+            masked_csrf_token = request.headers.get('X-RELIEF-CSRF-Token')
+            if masked_csrf_token is not None:
+                return masked_csrf_token
+            use_header = False
+        # Parsing the form means reading the entire body, which we avoid for
+        # bodies that cannot contain the token or that are too large.
+        if use_form and request.mimetype in self.CSRF_FORM_MIMETYPES:
+            masked_csrf_token = self._peek_masked_csrf_token()
+            if masked_csrf_token is None and self._may_parse_form():
+                masked_csrf_token = request.form.get('csrf_token')
+            if masked_csrf_token is not None:
+                return masked_csrf_token
+        if use_header:
+            return request.headers.get('X-RELIEF-CSRF-Token')
+        return None
+
+    def _get_expected_csrf_token(self):
+        # Returns the length of the token we expect and the token itself, which
+        # is `None` for stateless tokens. Returns `None` if there is no token
+        # in the session or the cookie.
+        if current_app.config['RELIEF_CSRF_STATELESS']:
+            return SIGNED_CSRF_TOKEN_LENGTH, None
+        if current_app.config['RELIEF_CSRF_DOUBLE_SUBMIT']:
+            csrf_token = self._load_cookie_csrf_token()
+        else:
+            csrf_token = session.get('_csrf_token')
+        if csrf_token is None:
+            return None
+        return len(csrf_token), csrf_token
+
+    def _verify_csrf_token(self, masked_csrf_token, csrf_token_length,
+                           csrf_token, stopwatch):
+        # Returns the outcome of the check.
+        if masked_csrf_token is None:
+            return 'missing_token'
+        request_csrf_token = unmask_csrf_token(
+            masked_csrf_token, csrf_token_length
+        )
+        stopwatch.lap('unmask')
+        if request_csrf_token is None:
+            return 'bad_encoding'
+        if csrf_token is None:
+            is_valid = check_signed_csrf_token(
+                request_csrf_token, current_app.secret_key,
+                current_app.config['RELIEF_CSRF_TOKEN_MAX_AGE'],
+                binding=self.get_csrf_binding()
+            )
+        else:
+            is_valid = constant_time_equal(request_csrf_token, csrf_token)
+        stopwatch.lap('compare')
+        return 'accepted' if is_valid else 'mismatch'
+
+    def _finish_csrf_check(self, outcome, timings):
+        record_csrf_check(current_app._get_current_object(), outcome, timings)
+        if outcome not in ('accepted', 'exempt'):
+            abort(400)
+
+    def _check_csrf_origin(self, stopwatch):
+        # Returns the outcome of the check, if it is settled by the origin of
+        # the request.
+        origin_check = current_app.config['RELIEF_CSRF_ORIGIN_CHECK']
+        if origin_check is None:
+            return None
+        is_trusted = is_trusted_origin(
+            request.environ, current_app.extensions['relief_trusted_origins']
+        )
+        stopwatch.lap('origin')
+        if is_trusted is False and origin_check == 'strict':
+            return 'bad_origin'
+        if is_trusted and origin_check == 'allow':
+            return 'accepted'
+        return None
 
     def _check_csrf_token(self):
-        csrf_token = touch_csrf_token()
+        # Requests with a safe method, including those for static files, are
+        # neither checked nor recorded.
         if request.method in self.CSRF_SAFE_METHODS:
             return
-        try:
-            masked_csrf_token = request.form['csrf_token']
-        except KeyError:
-            try:
-                masked_csrf_token = request.headers['X-RELIEF-CSRF-Token']
-            except KeyError:
-                abort(400)
-        try:
-            request_csrf_token = unmask_secret(masked_csrf_token)
-        except TypeError:
-            abort(400)
-        if not constant_time_equal(request_csrf_token, csrf_token):
-            abort(400)
+        policy = self._get_csrf_policy()
+        if policy == 'exempt':
+            return self._finish_csrf_check('exempt', {})
+        # Checked by the view with check_csrf_token_async.
+        if policy == 'async':
+            return
+        stopwatch = Stopwatch()
+        outcome = self._check_csrf_origin(stopwatch)
+        if outcome is not None:
+            return self._finish_csrf_check(outcome, stopwatch.timings)
+        expected_csrf_token = self._get_expected_csrf_token()
+        stopwatch.lap('session')
+        # Without a token in the session, there is nothing a token in the
+        # request could match.
+        if expected_csrf_token is None:
+            return self._finish_csrf_check('mismatch', stopwatch.timings)
+        masked_csrf_token = self._get_masked_csrf_token(policy)
+        stopwatch.lap('extract')
+        csrf_token_length, csrf_token = expected_csrf_token
+        outcome = self._verify_csrf_token(
+            masked_csrf_token, csrf_token_length, csrf_token, stopwatch
+        )
+        self._finish_csrf_check(outcome, stopwatch.timings)
+
+    def _render_metrics(self):
+        metrics = current_app.extensions['relief_metrics']
+        return current_app.response_class(
+            metrics.render(), content_type='text/plain; version=0.0.4'
+        )
 
 
-class WebForm(relief.Form):
+def _is_static_view(app, view):
+    if view is None:
+        return False
+    if view == app.send_static_file:
+        return True
+    return any(
+        blueprint.static_folder is not None and
+        view == blueprint.send_static_file
+        for blueprint in app.blueprints.values()
+    )
+
+
+def _iterlists(multidict):
+    # Plain multi dicts keep the values of each key in a list, which we can
+    # iterate over without having them copied.
+    if isinstance(multidict, MultiDict) and \
+            not isinstance(multidict, OrderedMultiDict):
+        return dict_iteritems(multidict)
+    return iterlists(multidict)
+
+
+def _is_cloneable(element_cls):
+    # Elements of a class can be cloned, if the class is one of the
+    # _CLONEABLE_ELEMENTS or a clone of one created with `using`,
+    # `validated_by` or `with_properties`, which only change attributes.
+    # Anything else, like a Secret whose masked value differs each time or a
+    # subclass overriding methods, is created from scratch.
+    if element_cls.default_factory is not relief.Unspecified:
+        return False
+    for cls in element_cls.__mro__:
+        if cls in _CLONEABLE_ELEMENTS:
+            return True
+        for value in cls.__dict__.values():
+            if callable(value) or \
+                    isinstance(value, (classmethod, staticmethod, property)):
+                return False
+    return False
+
+
+def _masks_like_secret(element_cls):
+    # Secrets can only be masked together, if the subclass does not change
+    # how a value is set or serialized.
+    return issubclass(element_cls, Secret) and \
+        element_cls.serialize == Secret.serialize and \
+        element_cls.set_from_native == Secret.set_from_native
+
+
+class _CompiledMember(object):
+    # Creates the elements for one member of a form, by cloning a prototype
+    # where possible.
+    def __init__(self, name, element_cls, validator_name):
+        self.name = name
+        self.element_cls = element_cls
+        self.validator_name = validator_name
+        if not _is_cloneable(element_cls):
+            self.prototype = None
+        else:
+            self.prototype = element_cls().__dict__
+            self.mutable_attributes = [
+                key for key, value in self.prototype.items()
+                if isinstance(value, (list, dict, set))
+            ]
+
+    def create(self, form):
+        if self.prototype is None:
+            element = self.element_cls()
+        else:
+            element = self.element_cls.__new__(self.element_cls)
+            state = element.__dict__
+            state.update(self.prototype)
+            for key in self.mutable_attributes:
+                state[key] = copy(state[key])
+        if self.validator_name is not None:
+            element.validators = self.element_cls.validators + [
+                getattr(form, self.validator_name)
+            ]
+        return element
+
+
+class _CompiledSchema(object):
+    # Everything about a form class that does not change between instances.
+    def __init__(self, form_cls):
+        self.field_names = frozenset(form_cls.member_schema)
+        self.members = [
+            _CompiledMember(
+                name, element_cls,
+                'validate_' + name
+                if callable(getattr(form_cls, 'validate_' + name, None))
+                else None
+            )
+            for name, element_cls in form_cls.member_schema.items()
+        ]
+
+
+class WebForm(AsyncWebFormMixin, relief.Form):
+    def __new__(cls, *args, **kwargs):
+        # relief.Form.__new__ looks for validation methods and creates every
+        # element from its class on each instantiation, we use the compiled
+        # schema instead.
+        self = super(relief.Form, cls).__new__(cls)
+        self._elements = OrderedDict()
+        for member in cls._compile().members:
+            self._elements[member.name] = member.create(self)
+        self.__dict__.update(self._elements)
+        return self
+
+    def __init__(self, value=relief.Unspecified):
+        if value is not relief.Unspecified or \
+                self.default is not relief.Unspecified or \
+                self.default_factory is not relief.Unspecified:
+            return super(WebForm, self).__init__(value)
+        # The elements are in their default state already, there is no need
+        # to reset them.
+        self._state = None
+        self.is_valid = None
+        self.raw_value = relief.Unspecified
+        self.errors = []
+
+    @classmethod
+    def _compile(cls):
+        # Each class has its own schema, it must not be inherited.
+        schema = cls.__dict__.get('_relief_compiled_schema')
+        if schema is None:
+            schema = cls._relief_compiled_schema = _CompiledSchema(cls)
+        return schema
+
     def set_and_validate_on_submit(self, context=None):
         if request.method == 'POST':
-            raw_value = {}
-            for key in self:
-                values = request.form.getlist(key)
-                if len(values) > 1:
-                    value = values
-                elif values:
-                    value = values[0]
-                else:
-                    value = relief.Unspecified
-                raw_value[key] = value
+            stopwatch = Stopwatch()
+            form = request.form
+            stopwatch.lap('parse')
+            field_names = self._compile().field_names
+            raw_value = dict.fromkeys(field_names, relief.Unspecified)
+            for key, values in _iterlists(form):
+                if key in field_names:
+                    raw_value[key] = values[0] if len(values) == 1 else \
+                        list(values)
             self.set_from_raw(raw_value)
-            return self.validate(context=context)
+            stopwatch.lap('bind')
+            is_valid = self.validate(context=context)
+            stopwatch.lap('validate')
+            record_form_submission(
+                current_app._get_current_object(), self,
+                'valid' if is_valid else 'invalid', stopwatch.timings
+            )
+            return is_valid
         return False
 
+    def _set_value_from_native(self, value):
+        if value is relief.Unspecified:
+            return super(WebForm, self)._set_value_from_native(value)
+        secrets = {False: [], True: []}
+        others = []
+        for key, native in value.items():
+            element = self[key]
+            if native is not relief.Unspecified and \
+                    _masks_like_secret(type(element)):
+                secrets[bool(element.compact)].append((element, native))
+            else:
+                others.append((element, native))
+        # Masking all secrets at once is a lot cheaper than letting each
+        # element mask its own secret.
+        for compact, batch in secrets.items():
+            masked = mask_secrets(
+                (native for _, native in batch), compact=compact
+            )
+            for (element, native), raw in zip(batch, masked):
+                element.value = native
+                element.raw_value = raw
+                element.is_valid = None
+        for element, native in others:
+            element.set_from_native(native)
+
 
 class Text(relief.Unicode):
     pass
@@ -113,15 +747,23 @@ class Secret(Hidden):
     .. warning:: This does not prevent anyone from seeing the secret, if the
                  connection to the client is unencrypted.
     """
+    #: If `True` the secret is masked using the compact format, see
+    #: :func:`~flask.ext.relief.crypto.mask_secret`.
+    compact = False
+
+    #: The maximum length of a masked secret, longer values are rejected
+    #: without attempting to unmask them. May be `None` to allow any length.
+    max_masked_length = 64 * 1024
+
     def serialize(self, value):
         if value is relief.Unspecified:
             return value
-        return mask_secret(value)
+        return mask_secret(value, compact=self.compact)
 
     def unserialize(self, value):
         try:
-            return unmask_secret(value)
-        except TypeError:
+            return unmask_secret(value, max_length=self.max_masked_length)
+        except (TypeError, NotImplementedError):
             return relief.NotUnserializable
 
 
@@ -193,27 +835,73 @@ class OptGroup(object):
         )
 
 
+def _iter_selectable_values(options):
+    for option in options:
+        if option.disabled:
+            continue
+        if isinstance(option, OptGroup):
+            for value in _iter_selectable_values(option.options):
+                yield value
+        else:
+            yield option.value
+
+
 class Select(relief.Element):
     options = None
     multiple = False
 
+    #: The maximum number of values that may be submitted, if :attr:`multiple`
+    #: is `True`. `None` means there is no limit.
+    max_selected = None
+
     def __init__(self, value=relief.Unspecified):
         super(Select, self).__init__(value=value)
         if self.options is None:
             raise TypeError('options are undefined')
 
+    def get_selectable_values(self):
+        """
+        Returns a frozenset of the values of all options that can be selected,
+        including those in option groups but excluding disabled ones.
+
+        The set is built once per :attr:`options` object, which is kept by
+        the class or by the element, if the options have been set on the
+        element. Changes made to the options in place afterwards are not
+        taken into account.
+        """
+        owner = self if 'options' in self.__dict__ else self.__class__
+        options, values = owner.__dict__.get(
+            '_relief_selectable_values', (None, None)
+        )
+        if options is not self.options:
+            values = frozenset(_iter_selectable_values(self.options))
+            setattr(owner, '_relief_selectable_values', (self.options, values))
+        return values
+
     def unserialize(self, value):
         if self.multiple:
             if value is relief.Unspecified:
-                values = set()
-            elif isinstance(value, list):
+                return set()
+            if not isinstance(value, list):
+                value = [value]
+            # Checked before anything is built from the submitted values.
+            if self.max_selected is not None and \
+                    len(value) > self.max_selected:
+                return relief.NotUnserializable
+            try:
                 values = set(value)
-            else:
-                values = set([value])
-            return set(values)
+            except TypeError:
+                return relief.NotUnserializable
+            if values <= self.get_selectable_values():
+                return values
         else:
-            if any(value == option.value for option in self.options):
-                return value
+            try:
+                if value in self.get_selectable_values():
+                    return value
+            except TypeError:
+                # Unhashable values, like a list of several submitted values,
+                # cannot have been selected.
+                pass
         return relief.NotUnserializable
 
 
@@ -231,6 +919,15 @@ class Submit(relief.Element):
         return relief.NotUnserializable
 
 
+#: Element classes whose instances are in the same state after each
+#: instantiation, apart from lists, dicts and sets that are copied.
+_CLONEABLE_ELEMENTS = frozenset([
+    relief.Boolean, relief.Integer, relief.Float, relief.Complex,
+    relief.Unicode, relief.Bytes, Text, Email, Password, Hidden, Checkbox,
+    Choice, MultipleChoice, Select, Submit
+])
+
+
 def _inherit_relief_exports():
     module = sys.modules[__name__]
     for attribute in relief.__all__:
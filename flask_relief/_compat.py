@@ -7,15 +7,42 @@
     :license: BSD, see LICENSE.rst for details
 """
 import sys
+from binascii import a2b_hex, b2a_hex
 from operator import methodcaller
+try:
+    from collections import OrderedDict # noqa
+except ImportError: # < 2.7
+    from ordereddict import OrderedDict # noqa
 
 
 PY2 = sys.version_info[0] == 2
 
 
 if PY2:
-    int_to_byte = chr
     text_type = unicode # noqa
+    dict_iteritems = dict.iteritems
+    iterlists = methodcaller('iterlists')
+
+    def implements_to_string(cls):
+        cls.__unicode__ = cls.__str__
+        cls.__str__ = lambda self: self.__unicode__().encode('utf-8')
+        return cls
+
+    def bytes_to_int(data):
+        return int(b2a_hex(data) or b'0', 16)
+
+    def int_to_bytes(integer, length):
+        if length == 0:
+            return b''
+        return a2b_hex(b'%0*x' % (length * 2, integer))
 else:
-    int_to_byte = methodcaller('to_bytes', 1, 'big')
     text_type = str
+    dict_iteritems = dict.items
+    iterlists = methodcaller('lists')
+    implements_to_string = lambda cls: cls
+
+    def bytes_to_int(data):
+        return int.from_bytes(data, 'big')
+
+    def int_to_bytes(integer, length):
+        return integer.to_bytes(length, 'big')
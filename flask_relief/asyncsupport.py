@@ -0,0 +1,93 @@
+# coding: utf-8
+"""
+    flask.ext.relief.asyncsupport
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Coroutine based variants of the methods of
+    :class:`~flask.ext.relief.Relief` and :class:`~flask.ext.relief.WebForm`
+    that read the body of the request. This module is only imported on Python
+    3.5 and later.
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from functools import partial
+try:
+    from asyncio import get_running_loop
+except ImportError: # < 3.7
+    from asyncio import get_event_loop as get_running_loop
+
+from flask import request, _request_ctx_stack, _app_ctx_stack
+
+from flask.ext.relief.metrics import Stopwatch
+
+
+def _call_in_context(app_context, request_context, function):
+    # Makes the given contexts the current ones in the executing thread. They
+    # are put on the stacks directly, pushing and popping the contexts
+    # themselves would run the teardown functions of the application and
+    # close the request, while it is still being handled.
+    _app_ctx_stack.push(app_context)
+    _request_ctx_stack.push(request_context)
+    try:
+        return function()
+    finally:
+        _request_ctx_stack.pop()
+        _app_ctx_stack.pop()
+
+
+async def _run_in_executor(function):
+    # Runs `function` in the default executor of the event loop, with the
+    # contexts of the current request.
+    return await get_running_loop().run_in_executor(None, partial(
+        _call_in_context, _app_ctx_stack.top, _request_ctx_stack.top,
+        function
+    ))
+
+
+class AsyncReliefMixin(object):
+    async def check_csrf_token_async(self):
+        """
+        Checks the CSRF token of a request to an endpoint with the
+        ``'async'`` policy like the before request function registered by
+        :class:`Relief` checks other requests, but reads the body of the
+        request in the default executor of the event loop, so that the loop
+        is not blocked.
+
+        Flask does not await before request functions, so this has to be
+        awaited by the view itself, before the body is accessed. For
+        endpoints with any other policy, the token has been checked already
+        and this does nothing.
+        """
+        if request.method in self.CSRF_SAFE_METHODS or \
+                self._get_csrf_policy() != 'async':
+            return
+        stopwatch = Stopwatch()
+        outcome = self._check_csrf_origin(stopwatch)
+        if outcome is not None:
+            return self._finish_csrf_check(outcome, stopwatch.timings)
+        expected_csrf_token = self._get_expected_csrf_token()
+        stopwatch.lap('session')
+        if expected_csrf_token is None:
+            return self._finish_csrf_check('mismatch', stopwatch.timings)
+        masked_csrf_token = await _run_in_executor(
+            partial(self._get_masked_csrf_token, 'default')
+        )
+        stopwatch.lap('extract')
+        csrf_token_length, csrf_token = expected_csrf_token
+        outcome = self._verify_csrf_token(
+            masked_csrf_token, csrf_token_length, csrf_token, stopwatch
+        )
+        self._finish_csrf_check(outcome, stopwatch.timings)
+
+
+class AsyncWebFormMixin(object):
+    async def set_and_validate_on_submit_async(self, context=None):
+        """
+        Like :meth:`set_and_validate_on_submit` but the form data is read in
+        the default executor of the event loop, so that the loop is not
+        blocked.
+        """
+        if request.method == 'POST':
+            await _run_in_executor(lambda: request.form)
+        return self.set_and_validate_on_submit(context=context)
@@ -6,23 +6,44 @@
     :copyright: 2013 by Daniel Neuhäuser
     :license: BSD, see LICENSE.rst for details
 """
-import os
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 from binascii import b2a_hex, a2b_hex, Error as BinASCIIError
 try:
     from hmac import compare_digest as _constant_time_equal
 except ImportError:
     _constant_time_equal = None
 
-from flask.ext.relief._compat import int_to_byte, PY2, text_type
+from flask.ext.relief._compat import (
+    PY2, text_type, bytes_to_int, int_to_bytes
+)
+from flask.ext.relief.entropy import urandom
+
+
+#: The version byte that precedes key and ciphertext in the compact format
+#: produced by :func:`mask_secret`. The URL-safe base64 encoding of this byte
+#: starts with ``_``, which never appears in the hex format, allowing
+#: :func:`unmask_secret` to tell both formats apart.
+COMPACT_MASK_VERSION = b'\xfc'
 
 
 def xor_bytes(a, b):
     """
     XORs each byte in `a` and `b` together and returns the concatenated result.
+
+    `a` and `b` may be any bytes-like objects, e.g. :class:`bytearray`. If they
+    differ in length, the longer one is truncated.
+
+    Instead of processing one byte at a time, both buffers are converted to
+    integers which are XORed as a whole.
     """
-    return b''.join(
-        int_to_byte(x ^ y) for x, y in zip(bytearray(a), bytearray(b))
-    )
+    length = min(len(a), len(b))
+    if length == 0:
+        return b''
+    if len(a) != length:
+        a = a[:length]
+    if len(b) != length:
+        b = b[:length]
+    return int_to_bytes(bytes_to_int(a) ^ bytes_to_int(b), length)
 
 
 def encrypt_once(plaintext):
@@ -30,7 +51,7 @@ def encrypt_once(plaintext):
     Returns a random key and the ciphertext of a one-time pad, generated using
     the returned key and the given `plaintext`. Expects everything to be bytes.
     """
-    key = os.urandom(len(plaintext))
+    key = urandom(len(plaintext))
     return key, xor_bytes(key, plaintext)
 
 
@@ -85,35 +106,149 @@ def constant_time_equal(a, b):
     return result == 0
 
 
-def mask_secret(secret):
-    """
-    Returns a randomized version the given `secret` by creating an OTP
-    concatenated with the key used for the OTP. The returned string is
-    guraanteed to be ASCII encodeable.
-    """
+def _tag_secret(secret):
     if isinstance(secret, text_type):
         tag = b'u'
         secret = secret.encode('latin1')
     else:
         tag = b'b'
-    key, encrypted_secret = encrypt_once(tag + secret)
+    return bytearray(tag) + secret
+
+
+def _encode_compact(key_encrypted_secret):
+    encoded = urlsafe_b64encode(COMPACT_MASK_VERSION + key_encrypted_secret)
+    return encoded.rstrip(b'=').decode('ascii')
+
+
+def _decode_compact(masked_secret):
+    padding = u'=' * (-len(masked_secret) % 4)
+    try:
+        if isinstance(masked_secret, text_type):
+            masked_secret = masked_secret.encode('ascii')
+        decoded = urlsafe_b64decode(masked_secret + padding.encode('ascii'))
+    except (TypeError, ValueError) as error:
+        raise TypeError(*error.args)
+    if decoded[:1] != COMPACT_MASK_VERSION:
+        raise TypeError('unknown mask format version')
+    return decoded[1:]
+
+
+def mask_secret(secret, compact=False):
+    """
+    Returns a randomized version the given `secret` by creating an OTP
+    concatenated with the key used for the OTP. The returned string is
+    guraanteed to be ASCII encodeable.
+
+    Besides unicode strings and bytes, `secret` may be any bytes-like object
+    such as a :class:`bytearray`, which will be unmasked as bytes.
+
+    By default key and OTP are hex encoded, if `compact` is `True` they are
+    encoded using URL-safe base64 instead, which results in a shorter string.
+    """
+    key, encrypted_secret = encrypt_once(_tag_secret(secret))
+    if compact:
+        return _encode_compact(key + encrypted_secret)
     return b2a_hex(key + encrypted_secret).decode('ascii')
 
 
-def unmask_secret(masked_secret):
+def mask_secrets(secrets, compact=False):
+    """
+    Returns a list of the given `secrets` masked with :func:`mask_secret`.
+
+    This is considerably faster than calling :func:`mask_secret` for each
+    secret, as the randomness for all secrets is read at once and all secrets
+    are encrypted and encoded together.
+    """
+    plaintexts = [_tag_secret(secret) for secret in secrets]
+    key, encrypted_secrets = encrypt_once(bytearray().join(plaintexts))
+    # Each masked secret consists of its key followed by its ciphertext, so we
+    # arrange the parts in that order within one buffer, encode the buffer and
+    # slice the result.
+    buffer = bytearray(len(key) * 2)
+    start = 0
+    for plaintext in plaintexts:
+        end = start + len(plaintext)
+        buffer[start * 2:start + end] = key[start:end]
+        buffer[start + end:end * 2] = encrypted_secrets[start:end]
+        start = end
+    if compact:
+        masked_secrets = []
+        start = 0
+        for plaintext in plaintexts:
+            end = start + len(plaintext) * 2
+            masked_secrets.append(_encode_compact(buffer[start:end]))
+            start = end
+        return masked_secrets
+    encoded = b2a_hex(buffer).decode('ascii')
+    masked_secrets = []
+    start = 0
+    for plaintext in plaintexts:
+        end = start + len(plaintext) * 4
+        masked_secrets.append(encoded[start:end])
+        start = end
+    return masked_secrets
+
+
+def masked_secret_length(length, compact=False):
+    """
+    Returns the length of the string returned by :func:`mask_secret` for a
+    secret that is `length` characters or bytes long.
+    """
+    # The secret is prefixed with a tag and both key and ciphertext have the
+    # length of the tagged secret.
+    if compact:
+        return ((2 * (length + 1) + 1) * 4 + 2) // 3
+    return 4 * (length + 1)
+
+
+def _check_shape(masked_secret, max_length):
+    length = len(masked_secret)
+    if max_length is not None and length > max_length:
+        raise TypeError('masked secret is too long')
+    if masked_secret[:1] in (u'_', b'_'):
+        # The version byte and a key and ciphertext of at least one byte each,
+        # make up an odd number of bytes, encoded without padding.
+        decoded_length = length * 3 // 4
+        if length % 4 == 1 or decoded_length < 3 or not decoded_length % 2:
+            raise TypeError('masked secret has an invalid length')
+        return decoded_length
+    # Key and ciphertext of at least one byte each and of equal length,
+    # encoded with two characters per byte.
+    if length < 4 or length % 4:
+        raise TypeError('masked secret has an invalid length')
+    return None
+
+
+def unmask_secret(masked_secret, max_length=None):
     """
     Unmasks a secret string that has been marked with :func:`mask_secret`.
+    Both the hex and the compact format are accepted.
+
+    If `masked_secret` is longer than `max_length` or the length is not one
+    :func:`mask_secret` could have produced, it is rejected before any
+    decoding takes place.
 
     Raises a :exc:`TypeError`, if `masked_secret` is invalid.
     """
-    try:
-        key_encrypted_secret = a2b_hex(masked_secret)
-    except (TypeError, BinASCIIError) as error:
-        raise TypeError(*error.args)
+    decoded_length = _check_shape(masked_secret, max_length)
+    if decoded_length is not None:
+        key_encrypted_secret = _decode_compact(masked_secret)
+        # Characters outside of the base64 alphabet are silently ignored
+        # during decoding, this shows up as a length mismatch.
+        if len(key_encrypted_secret) + 1 != decoded_length:
+            raise TypeError('masked secret contains invalid characters')
+    else:
+        try:
+            key_encrypted_secret = a2b_hex(masked_secret)
+        except (TypeError, ValueError, BinASCIIError) as error:
+            raise TypeError(*error.args)
+    # Splitting the integer instead of the bytes saves us from copying both
+    # halves, before they are XORed together.
     length_of_parts = len(key_encrypted_secret) // 2
-    key = key_encrypted_secret[:length_of_parts]
-    encrypted_secret = key_encrypted_secret[length_of_parts:]
-    decrypted = decrypt_once(key, encrypted_secret)
+    parts = bytes_to_int(key_encrypted_secret)
+    key = parts >> (length_of_parts * 8)
+    encrypted_secret = parts & ((1 << (length_of_parts * 8)) - 1)
+    decrypted = int_to_bytes(key ^ encrypted_secret, length_of_parts)
     tag, secret = decrypted[0:1], decrypted[1:]
     if tag == b'u':
         return secret.decode('latin1')
@@ -121,3 +256,16 @@ def unmask_secret(masked_secret):
         return secret
     else:
         raise NotImplementedError('secret masked with bad version')
+
+
+def unmask_secrets(masked_secrets, max_length=None):
+    """
+    Returns a list of the given `masked_secrets` unmasked with
+    :func:`unmask_secret`.
+
+    Raises a :exc:`TypeError`, if any of the `masked_secrets` is invalid.
+    """
+    return [
+        unmask_secret(masked_secret, max_length=max_length)
+        for masked_secret in masked_secrets
+    ]
@@ -7,12 +7,24 @@
     :license: BSD, see LICENSE.rst for details
 """
 from __future__ import division
-from random import SystemRandom
+import os
+import hashlib
+import threading
+from collections import deque
 
 from flask import session
+from itsdangerous import Signer, TimestampSigner, BadSignature
+from werkzeug.urls import url_parse
+from werkzeug.wsgi import get_host
+
+from flask.ext.relief._compat import text_type
+from flask.ext.relief.crypto import (
+    unmask_secret, masked_secret_length
+)
+from flask.ext.relief.entropy import pool, PooledRandom, urandom
 
 
-random = SystemRandom()
+random = PooledRandom(pool)
 
 
 #: The default characters used for csrf tokens.
@@ -28,14 +40,240 @@ def generate_csrf_token(length=20, alphabet=CSRF_TOKEN_CHARACTERS):
     Generates a random string of characters `length` long from the given
     `alphabet`.
     """
-    return u''.join(random.choice(alphabet) for _ in range(length))
+    size = len(alphabet)
+    if size > 256:
+        return u''.join(random.choice(alphabet) for _ in range(length))
+    # Each random byte picks a character. Bytes from `limit` upwards are
+    # rejected, otherwise the characters at the start of the alphabet would be
+    # picked more often than the others.
+    limit = 256 - 256 % size
+    characters = []
+    while len(characters) < length:
+        missing = length - len(characters)
+        for byte in bytearray(urandom(missing * 256 // limit + 1)):
+            if byte < limit:
+                characters.append(alphabet[byte % size])
+    return u''.join(characters[:length])
+
+
+class TokenReservoir(object):
+    """
+    Holds up to `size` tokens generated with :func:`generate_csrf_token` in
+    advance, which are refilled by a background thread, once less than half of
+    them are left.
+
+    This helps with bursts of requests that all need new tokens. Tokens are
+    discarded in processes forked from the one that generated them.
+    """
+    def __init__(self, size=1024, length=20, alphabet=CSRF_TOKEN_CHARACTERS):
+        self.size = size
+        self.length = length
+        self.alphabet = alphabet
+        self._tokens = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._pid = os.getpid()
+
+    def get(self):
+        """
+        Returns a token, generating one if the reservoir is empty.
+        """
+        if os.getpid() != self._pid:
+            self._tokens.clear()
+            self._lock = threading.Lock()
+            self._refilling = False
+            self._pid = os.getpid()
+        try:
+            token = self._tokens.popleft()
+        except IndexError:
+            token = generate_csrf_token(self.length, self.alphabet)
+        if len(self._tokens) < self.size // 2:
+            self._start_refill()
+        return token
+
+    def fill(self):
+        """
+        Fills the reservoir in the calling thread.
+        """
+        while len(self._tokens) < self.size:
+            self._tokens.append(
+                generate_csrf_token(self.length, self.alphabet)
+            )
+
+    def _start_refill(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        thread = threading.Thread(target=self._refill)
+        thread.daemon = True
+        thread.start()
+
+    def _refill(self):
+        try:
+            self.fill()
+        finally:
+            self._refilling = False
+
+
+def unmask_csrf_token(masked_csrf_token, length):
+    """
+    Returns the CSRF token masked in `masked_csrf_token`, if it is a masked
+    unicode string of the given `length`, otherwise `None`.
+
+    As the length of the token is known, anything that cannot be a masked
+    version of it is rejected without decoding it.
+    """
+    if len(masked_csrf_token) not in (
+        masked_secret_length(length),
+        masked_secret_length(length, compact=True)
+    ):
+        return None
+    try:
+        csrf_token = unmask_secret(masked_csrf_token)
+    except (TypeError, NotImplementedError):
+        return None
+    if not isinstance(csrf_token, text_type):
+        return None
+    return csrf_token
 
 
-def touch_csrf_token():
+def touch_csrf_token(generate=generate_csrf_token):
     """
     Generates CSRF token and puts it into the session, if not present. Always
     returns the CSRF token.
+
+    Tokens are created by calling `generate`, e.g. :meth:`TokenReservoir.get`.
     """
     if '_csrf_token' not in session:
-        session['_csrf_token'] = generate_csrf_token()
+        session['_csrf_token'] = generate()
     return session['_csrf_token']
+
+
+def _get_cookie_signer(secret_key):
+    return Signer(
+        secret_key, salt='relief-csrf-cookie', digest_method=hashlib.sha256
+    )
+
+
+def dump_cookie_csrf_token(csrf_token, secret_key):
+    """
+    Returns the value of a cookie carrying `csrf_token`, signed with
+    `secret_key`.
+    """
+    return _get_cookie_signer(secret_key).sign(
+        csrf_token.encode('utf-8')
+    ).decode('utf-8')
+
+
+def load_cookie_csrf_token(value, secret_key):
+    """
+    Returns the CSRF token from a cookie `value` created by
+    :func:`dump_cookie_csrf_token` or `None`, if the signature is invalid.
+    """
+    try:
+        csrf_token = _get_cookie_signer(secret_key).unsign(value)
+    except BadSignature:
+        return None
+    try:
+        return csrf_token.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+class _CSRFTokenSigner(TimestampSigner):
+    # Signs the binding of stateless tokens, with a salt of its own, so that
+    # the signatures cannot be confused with those of sessions or cookies.
+    # `now` replaces the current time.
+    def __init__(self, secret_key, now=None):
+        super(_CSRFTokenSigner, self).__init__(
+            secret_key, salt='relief-csrf-token', digest_method=hashlib.sha256
+        )
+        self.now = now
+
+    def get_timestamp(self):
+        if self.now is None:
+            return super(_CSRFTokenSigner, self).get_timestamp()
+        return int(self.now)
+
+    def timestamp_to_datetime(self, timestamp):
+        return timestamp
+
+
+def _encode_binding(binding):
+    if isinstance(binding, text_type):
+        binding = binding.encode('utf-8')
+    return binding
+
+
+def generate_signed_csrf_token(secret_key, binding=u'', timestamp=None):
+    """
+    Generates a CSRF token that does not have to be stored anywhere, because
+    it consists of a timestamp and a signature of the timestamp and the given
+    `binding` using `secret_key`. The binding itself is not part of the
+    token.
+
+    `binding` can be used to tie the token to a client, e.g. by passing the id
+    of the user. `timestamp` defaults to the current time.
+    """
+    signer = _CSRFTokenSigner(secret_key, now=timestamp)
+    binding = _encode_binding(binding)
+    # The binding is known when the token is checked, there is no need to
+    # keep it in the token.
+    return signer.sign(binding)[len(binding) + 1:].decode('ascii')
+
+
+#: The length of tokens generated by :func:`generate_signed_csrf_token`.
+SIGNED_CSRF_TOKEN_LENGTH = len(generate_signed_csrf_token(b''))
+
+
+def check_signed_csrf_token(token, secret_key, max_age, binding=u'',
+                            now=None):
+    """
+    Returns `True` if the given `token` has been generated by
+    :func:`generate_signed_csrf_token` with the given `secret_key` and
+    `binding`, no more than `max_age` seconds before `now`.
+    """
+    if not isinstance(token, text_type):
+        return False
+    signer = _CSRFTokenSigner(secret_key, now=now)
+    try:
+        _, issued = signer.unsign(
+            _encode_binding(binding) + b'.' + token.encode('ascii'),
+            max_age=max_age, return_timestamp=True
+        )
+    except (BadSignature, UnicodeEncodeError):
+        return False
+    # Tokens from the future have not been generated by us.
+    return issued <= signer.get_timestamp()
+
+
+def normalize_origin(origin):
+    """
+    Returns `origin`, e.g. ``'https://example.com'``, in the form used to
+    compare origins.
+    """
+    return origin.rstrip(u'/').lower()
+
+
+def is_trusted_origin(environ, trusted_origins):
+    """
+    Returns whether the request described by the WSGI `environ` comes from
+    the origin of the application itself or from one of the normalized
+    `trusted_origins`. The origin is taken from the ``Origin`` header or, if
+    that is missing, from the ``Referer``. Returns `None`, if the request
+    carries neither header.
+    """
+    origin = environ.get('HTTP_ORIGIN')
+    if origin is None:
+        referer = environ.get('HTTP_REFERER')
+        if not referer:
+            return None
+        url = url_parse(referer)
+        origin = url.scheme + u'://' + url.netloc
+    origin = normalize_origin(origin)
+    if origin == normalize_origin(
+        environ['wsgi.url_scheme'] + u'://' + get_host(environ)
+    ):
+        return True
+    return origin in trusted_origins
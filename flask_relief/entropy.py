@@ -0,0 +1,104 @@
+# coding: utf-8
+"""
+    flask.ext.relief.entropy
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from __future__ import division
+import os
+import weakref
+import threading
+from random import SystemRandom
+
+from flask.ext.relief._compat import bytes_to_int
+
+
+#: The default size of the buffer used by an :class:`EntropyPool` in bytes.
+DEFAULT_POOL_SIZE = 4096
+
+
+# A lock held by another thread during a fork would never be released in the
+# child, so we replace the locks of all pools on top of checking the pid in
+# EntropyPool.read. The pools are only referenced weakly, so that they can
+# still be freed.
+_pools = weakref.WeakSet()
+
+
+def _reset_pools():
+    for pool in list(_pools):
+        pool._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools)
+
+
+class EntropyPool(object):
+    """
+    A buffer of random bytes obtained from :func:`os.urandom`, which is
+    refilled with a single system call, whenever it runs out.
+
+    The pool is thread-safe. It discards its contents in a process that has
+    been forked from the one that filled it, so that workers never hand out the
+    same bytes.
+    """
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self._reset()
+        _pools.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._buffer = b''
+        self._position = 0
+        self._pid = None
+
+    def read(self, n):
+        """
+        Returns `n` random bytes.
+        """
+        if n > self.size:
+            return os.urandom(n)
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid or self._position + n > len(self._buffer):
+                self._buffer = os.urandom(self.size)
+                self._position = 0
+                self._pid = pid
+            start = self._position
+            self._position += n
+            return self._buffer[start:self._position]
+
+
+class PooledRandom(SystemRandom):
+    """
+    A :class:`random.SystemRandom` that draws the randomness from the given
+    :class:`EntropyPool`, instead of reading from :func:`os.urandom` every
+    time.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        super(PooledRandom, self).__init__()
+
+    def random(self):
+        # Same as SystemRandom.random, 53 bits of randomness for the mantissa.
+        return (bytes_to_int(self.pool.read(7)) >> 3) * 2 ** -53
+
+    def getrandbits(self, k):
+        if k <= 0:
+            raise ValueError('number of bits must be greater than zero')
+        length = (k + 7) // 8
+        return bytes_to_int(self.pool.read(length)) >> (length * 8 - k)
+
+
+#: The :class:`EntropyPool` shared by everything within Flask-Relief.
+pool = EntropyPool()
+
+
+def urandom(n):
+    """
+    Returns `n` random bytes from the shared :data:`pool`.
+    """
+    return pool.read(n)
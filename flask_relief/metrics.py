@@ -0,0 +1,264 @@
+# coding: utf-8
+"""
+    flask.ext.relief.metrics
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import os
+import mmap
+import glob
+import struct
+import threading
+from timeit import default_timer
+
+from flask import g
+
+from flask.ext.relief.signals import csrf_checked, form_submitted
+
+
+#: Outcomes of a CSRF check. `'exempt'` is the outcome for endpoints with the
+#: ``'exempt'`` policy, requests using a safe method are not checked and
+#: therefore not recorded at all.
+CSRF_OUTCOMES = (
+    'accepted', 'missing_token', 'bad_encoding', 'mismatch', 'bad_origin',
+    'exempt'
+)
+
+#: Timed stages of a CSRF check: checking the origin, loading the token from
+#: the session, finding the token in the request, unmasking and comparing it.
+CSRF_STAGES = ('origin', 'session', 'extract', 'unmask', 'compare')
+
+#: Outcomes of a form submission.
+FORM_OUTCOMES = ('valid', 'invalid')
+
+#: Timed stages of a form submission: parsing the body, setting the value and
+#: validating it.
+FORM_STAGES = ('parse', 'bind', 'validate')
+
+#: Upper bounds of the latency histogram buckets in seconds.
+BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+
+
+class Stopwatch(object):
+    """
+    Measures the time between consecutive calls of :meth:`lap`.
+    """
+    def __init__(self):
+        #: Maps stage names to the time they took in seconds.
+        self.timings = {}
+        self.last = default_timer()
+
+    def lap(self, stage):
+        now = default_timer()
+        self.timings[stage] = now - self.last
+        self.last = now
+
+
+class MemoryStorage(object):
+    """
+    Stores `size` values in memory of the current process.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size
+        self.lock = threading.Lock()
+
+    def add(self, index, amount):
+        with self.lock:
+            self.values[index] += amount
+
+    def collect(self):
+        with self.lock:
+            return list(self.values)
+
+
+class MmapStorage(object):
+    """
+    Stores `size` values in a memory mapped file in `directory`, there is one
+    file per process. :meth:`collect` sums up the values of all files in the
+    directory, so any process can report the values of all processes, e.g. of
+    all gunicorn workers.
+
+    The directory should be emptied, when the application is deployed.
+    """
+    _format = '<d'
+    _value_size = struct.calcsize(_format)
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.mmap = None
+
+    def _open(self):
+        path = os.path.join(self.directory, 'relief-%d.db' % os.getpid())
+        length = self.size * self._value_size
+        # A file left behind by a process that had the same pid is reused,
+        # the values only ever grow, so nothing is lost.
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() != length:
+                file.seek(0)
+                file.write(b'\x00' * length)
+                file.truncate()
+                file.flush()
+            self.mmap = mmap.mmap(file.fileno(), length)
+        self.pid = os.getpid()
+
+    def add(self, index, amount):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._open()
+            start = index * self._value_size
+            end = start + self._value_size
+            value, = struct.unpack(self._format, self.mmap[start:end])
+            self.mmap[start:end] = struct.pack(self._format, value + amount)
+
+    def collect(self):
+        values = [0.0] * self.size
+        format = '<%dd' % self.size
+        length = struct.calcsize(format)
+        for path in glob.glob(os.path.join(self.directory, 'relief-*.db')):
+            with open(path, 'rb') as file:
+                data = file.read()
+            # Files written with a different set of metrics are ignored.
+            if len(data) != length:
+                continue
+            for index, value in enumerate(struct.unpack(format, data)):
+                values[index] += value
+        return values
+
+
+class Metrics(object):
+    """
+    Counts the outcomes of CSRF checks and form submissions and keeps
+    histograms of the time their stages take.
+
+    Values are kept in memory, unless a `directory` is given, in which case
+    they are shared between processes, see :class:`MmapStorage`.
+    """
+    #: The kinds of events observed with their name and their outcomes and
+    #: stages.
+    kinds = (
+        ('csrf', 'relief_csrf_checks', CSRF_OUTCOMES, CSRF_STAGES),
+        ('form', 'relief_form_submissions', FORM_OUTCOMES, FORM_STAGES)
+    )
+
+    def __init__(self, directory=None):
+        self.counters = {}
+        self.histograms = {}
+        index = 0
+        for kind, _, outcomes, stages in self.kinds:
+            for outcome in outcomes:
+                self.counters[kind, outcome] = index
+                index += 1
+            for stage in stages:
+                self.histograms[kind, stage] = index
+                # A value per bucket, one for +Inf and the sum.
+                index += len(BUCKETS) + 2
+        if directory is None:
+            self.storage = MemoryStorage(index)
+        else:
+            self.storage = MmapStorage(directory, index)
+
+    def observe(self, kind, outcome, timings):
+        """
+        Records an event of the given `kind` with an `outcome` and the
+        `timings` of its stages.
+        """
+        self.storage.add(self.counters[kind, outcome], 1)
+        for stage, duration in timings.items():
+            index = self.histograms[kind, stage]
+            for bucket, upper_bound in enumerate(BUCKETS):
+                if duration <= upper_bound:
+                    break
+            else:
+                bucket = len(BUCKETS)
+            self.storage.add(index + bucket, 1)
+            self.storage.add(index + len(BUCKETS) + 1, duration)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        values = self.storage.collect()
+        lines = []
+        for kind, prefix, outcomes, stages in self.kinds:
+            name = prefix + '_total'
+            lines.append('# TYPE %s counter' % name)
+            for outcome in outcomes:
+                lines.append('%s{outcome="%s"} %r' % (
+                    name, outcome, values[self.counters[kind, outcome]]
+                ))
+            name = 'relief_%s_stage_seconds' % kind
+            lines.append('# TYPE %s histogram' % name)
+            for stage in stages:
+                index = self.histograms[kind, stage]
+                count = 0.0
+                upper_bounds = [repr(bound) for bound in BUCKETS] + ['+Inf']
+                for bucket, upper_bound in enumerate(upper_bounds):
+                    count += values[index + bucket]
+                    lines.append('%s_bucket{stage="%s",le="%s"} %r' % (
+                        name, stage, upper_bound, count
+                    ))
+                lines.append('%s_sum{stage="%s"} %r' % (
+                    name, stage, values[index + len(BUCKETS) + 1]
+                ))
+                lines.append('%s_count{stage="%s"} %r' % (name, stage, count))
+        return u'\n'.join(lines) + u'\n'
+
+
+def add_server_timings(kind, timings):
+    """
+    Adds `timings` of the given `kind` to ``g.relief_timings``, if the current
+    request is timed, see ``RELIEF_SERVER_TIMING``. Timings of stages that
+    occur more than once are summed up.
+    """
+    server_timings = getattr(g, 'relief_timings', None)
+    if server_timings is None:
+        return
+    for stage, duration in timings.items():
+        name = 'relief-%s-%s' % (kind, stage)
+        server_timings[name] = server_timings.get(name, 0) + duration
+
+
+def format_server_timing(server_timings):
+    """
+    Returns the value of a ``Server-Timing`` header for the given mapping of
+    names to durations in seconds.
+    """
+    return ', '.join(
+        '%s;dur=%.3f' % (name, duration * 1000)
+        for name, duration in sorted(server_timings.items())
+    )
+
+
+def record_csrf_check(app, outcome, timings):
+    """
+    Sends :data:`~flask.ext.relief.signals.csrf_checked` and records the check
+    in the metrics of `app`, if they are enabled.
+    """
+    csrf_checked.send(app, outcome=outcome, timings=timings)
+    add_server_timings('csrf', timings)
+    metrics = app.extensions.get('relief_metrics')
+    if metrics is not None:
+        metrics.observe('csrf', outcome, timings)
+
+
+def record_form_submission(app, form, outcome, timings):
+    """
+    Sends :data:`~flask.ext.relief.signals.form_submitted` and records the
+    submission in the metrics of `app`, if they are enabled.
+    """
+    form_submitted.send(app, form=form, outcome=outcome, timings=timings)
+    add_server_timings('form', timings)
+    metrics = app.extensions.get('relief_metrics')
+    if metrics is not None:
+        metrics.observe('form', outcome, timings)
@@ -0,0 +1,231 @@
+# coding: utf-8
+"""
+    flask.ext.relief.middleware
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from datetime import timedelta
+
+from flask.helpers import total_seconds
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.exceptions import BadRequest, HTTPException
+from werkzeug.http import parse_cookie, parse_options_header
+
+from flask.ext.relief.crypto import constant_time_equal
+from flask.ext.relief.csrf import (
+    unmask_csrf_token, check_signed_csrf_token, load_cookie_csrf_token,
+    normalize_origin, is_trusted_origin, SIGNED_CSRF_TOKEN_LENGTH
+)
+from flask.ext.relief.streaming import peek_form_field
+
+
+class CSRFMiddleware(object):
+    """
+    WSGI middleware that responds with a 400, to requests that do not carry a
+    valid CSRF token, without calling the wrapped `app`.
+
+    The token is taken from the ``X-RELIEF-CSRF-Token`` header or from the
+    beginning of the body, see
+    :func:`~flask.ext.relief.streaming.peek_form_field`. It is compared to the
+    token in the session cookie of a Flask application using `secret_key` and
+    the default session interface. If `stateless` is `True`, the token is
+    verified as a signed token instead, `binding` has to be a function that
+    is called with the WSGI environment and returns the binding, matching
+    :meth:`~flask.ext.relief.Relief.get_csrf_binding`. If
+    `csrf_cookie_name` is given, the token is compared to the one in the
+    signed cookie of that name, as used by double submit mode.
+
+    If `origin_check` is given, the origin of the request is checked first,
+    like :meth:`~flask.ext.relief.Relief.init_app` describes for
+    ``RELIEF_CSRF_ORIGIN_CHECK``, with the given `trusted_origins`.
+
+    Requests whose token cannot be found within the first `streaming_limit`
+    bytes of the body, are passed on to the application, where
+    :class:`~flask.ext.relief.Relief` checks them as usual. Requests whose
+    path starts with one of the `exempt_paths` are never checked. If
+    `get_csrf_policy` is given, it is called with the WSGI environment and
+    requests are only checked, if it returns ``'default'``, any other policy
+    is left to the application.
+
+    As the middleware does not rely on routing by default, it can be placed
+    in front of e.g. a :class:`~werkzeug.wsgi.DispatcherMiddleware` with
+    several Flask applications that share the same secret key. Use
+    :meth:`from_app` to put it in front of a single application instead.
+    """
+    #: Methods that are not checked, same as
+    #: :attr:`~flask.ext.relief.Relief.CSRF_SAFE_METHODS`.
+    safe_methods = frozenset(['GET', 'HEAD'])
+
+    #: Mimetypes of request bodies that may contain a CSRF token.
+    form_mimetypes = frozenset([
+        'application/x-www-form-urlencoded', 'multipart/form-data'
+    ])
+
+    def __init__(self, app, secret_key, stateless=False, max_age=3600,
+                 binding=None, session_cookie_name='session',
+                 session_max_age=timedelta(days=31), exempt_paths=(),
+                 streaming_limit=4096, csrf_cookie_name=None,
+                 origin_check=None, trusted_origins=(), get_csrf_policy=None):
+        if stateless and binding is None:
+            raise ValueError('stateless csrf tokens require a binding')
+        self.app = app
+        self.secret_key = secret_key
+        self.stateless = stateless
+        self.max_age = max_age
+        self.binding = binding
+        self.session_cookie_name = session_cookie_name
+        if isinstance(session_max_age, timedelta):
+            session_max_age = total_seconds(session_max_age)
+        self.session_max_age = session_max_age
+        self.exempt_paths = tuple(exempt_paths)
+        self.streaming_limit = streaming_limit
+        self.csrf_cookie_name = csrf_cookie_name
+        self.origin_check = origin_check
+        self.trusted_origins = frozenset(
+            normalize_origin(origin) for origin in trusted_origins
+        )
+        self.get_csrf_policy = get_csrf_policy
+
+        interface = SecureCookieSessionInterface()
+        self.session_serializer = URLSafeTimedSerializer(
+            secret_key, salt=interface.salt,
+            serializer=interface.serializer,
+            signer_kwargs={
+                'key_derivation': interface.key_derivation,
+                'digest_method': interface.digest_method
+            }
+        )
+
+    @classmethod
+    def from_app(cls, app, flask_app, **kwargs):
+        """
+        Returns a middleware wrapping `app`, configured using the secret key,
+        session settings and Relief configuration of the given `flask_app`.
+
+        The policies of the endpoints of `flask_app` are taken into account,
+        so requests to exempt endpoints or endpoints with any policy other
+        than ``'default'`` are left to Relief.
+        """
+        config = flask_app.config
+        relief = flask_app.extensions['relief']
+
+        def get_csrf_policy(environ):
+            adapter = flask_app.url_map.bind_to_environ(
+                environ, server_name=config['SERVER_NAME']
+            )
+            try:
+                endpoint, _ = adapter.match()
+            except HTTPException:
+                return 'default'
+            return relief.get_endpoint_csrf_policy(flask_app, endpoint)
+
+        kwargs.setdefault('get_csrf_policy', get_csrf_policy)
+        kwargs.setdefault('secret_key', flask_app.secret_key)
+        kwargs.setdefault('stateless', config.get('RELIEF_CSRF_STATELESS'))
+        kwargs.setdefault(
+            'max_age', config.get('RELIEF_CSRF_TOKEN_MAX_AGE', 3600)
+        )
+        kwargs.setdefault('session_cookie_name', flask_app.session_cookie_name)
+        kwargs.setdefault(
+            'session_max_age', flask_app.permanent_session_lifetime
+        )
+        kwargs.setdefault(
+            'streaming_limit', config.get('RELIEF_CSRF_STREAMING_LIMIT', 4096)
+        )
+        kwargs.setdefault('origin_check', config['RELIEF_CSRF_ORIGIN_CHECK'])
+        kwargs.setdefault(
+            'trusted_origins', config['RELIEF_CSRF_TRUSTED_ORIGINS']
+        )
+        if config.get('RELIEF_CSRF_DOUBLE_SUBMIT'):
+            kwargs.setdefault(
+                'csrf_cookie_name', config['RELIEF_CSRF_COOKIE_NAME']
+            )
+        return cls(app, **kwargs)
+
+    def load_session_csrf_token(self, environ):
+        """
+        Returns the CSRF token stored in the session cookie or `None`.
+        """
+        cookie = parse_cookie(environ).get(self.session_cookie_name)
+        if not cookie:
+            return None
+        try:
+            session = self.session_serializer.loads(
+                cookie, max_age=self.session_max_age
+            )
+        except BadSignature:
+            return None
+        return session.get('_csrf_token')
+
+    def load_cookie_csrf_token(self, environ):
+        """
+        Returns the CSRF token stored in the CSRF cookie or `None`.
+        """
+        value = parse_cookie(environ).get(self.csrf_cookie_name)
+        if not value:
+            return None
+        return load_cookie_csrf_token(value, self.secret_key)
+
+    def check(self, environ):
+        """
+        Returns `True` if the request carries a valid CSRF token, `False` if
+        it does not and `None` if that cannot be decided without parsing the
+        entire body.
+        """
+        if self.origin_check is not None:
+            is_trusted = is_trusted_origin(environ, self.trusted_origins)
+            if is_trusted is False and self.origin_check == 'strict':
+                return False
+            if is_trusted and self.origin_check == 'allow':
+                return True
+        if self.stateless:
+            csrf_token_length = SIGNED_CSRF_TOKEN_LENGTH
+        else:
+            if self.csrf_cookie_name is None:
+                csrf_token = self.load_session_csrf_token(environ)
+            else:
+                csrf_token = self.load_cookie_csrf_token(environ)
+            if csrf_token is None:
+                return False
+            csrf_token_length = len(csrf_token)
+        masked_csrf_token = environ.get('HTTP_X_RELIEF_CSRF_TOKEN')
+        if masked_csrf_token is None:
+            mimetype, _ = parse_options_header(environ.get('CONTENT_TYPE', ''))
+            if mimetype not in self.form_mimetypes:
+                return False
+            masked_csrf_token = peek_form_field(
+                environ, 'csrf_token', limit=self.streaming_limit
+            )
+            if masked_csrf_token is None:
+                return None
+        request_csrf_token = unmask_csrf_token(
+            masked_csrf_token, csrf_token_length
+        )
+        if request_csrf_token is None:
+            return False
+        if self.stateless:
+            return check_signed_csrf_token(
+                request_csrf_token, self.secret_key, self.max_age,
+                binding=self.binding(environ)
+            )
+        return constant_time_equal(request_csrf_token, csrf_token)
+
+    def is_exempt(self, environ):
+        """
+        Returns `True` if the request is not checked by the middleware.
+        """
+        if environ.get('REQUEST_METHOD', 'GET') in self.safe_methods:
+            return True
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        if path.startswith(self.exempt_paths):
+            return True
+        return self.get_csrf_policy is not None and \
+            self.get_csrf_policy(environ) != 'default'
+
+    def __call__(self, environ, start_response):
+        if not self.is_exempt(environ) and self.check(environ) is False:
+            return BadRequest()(environ, start_response)
+        return self.app(environ, start_response)
@@ -0,0 +1,28 @@
+# coding: utf-8
+"""
+    flask.ext.relief.signals
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Signals sent by Flask-Relief. Like Flask's own signals they require
+    blinker, without it sending them does nothing.
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from flask.signals import Namespace
+
+
+_signals = Namespace()
+
+#: Sent with the application as sender, after the CSRF token of a request has
+#: been checked, which does not happen for requests using a safe method.
+#: Receivers get the `outcome`, one of
+#: :data:`~flask.ext.relief.metrics.CSRF_OUTCOMES`, and `timings`, a dictionary
+#: mapping the stages of the check that have been reached to the time they took
+#: in seconds.
+csrf_checked = _signals.signal('relief-csrf-checked')
+
+#: Sent with the application as sender, after a
+#: :class:`~flask.ext.relief.WebForm` has been submitted. Receivers get the
+#: `form`, the `outcome`, either `'valid'` or `'invalid'`, and `timings`.
+form_submitted = _signals.signal('relief-form-submitted')
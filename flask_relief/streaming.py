@@ -0,0 +1,152 @@
+# coding: utf-8
+"""
+    flask.ext.relief.streaming
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from werkzeug.http import parse_options_header
+from werkzeug.urls import url_unquote_plus
+
+
+# Returned by the finders, if the field might still be found in the data that
+# has not been read yet.
+_need_more = object()
+
+
+class ReplayStream(object):
+    """
+    A stream that returns the bytes in `prefix`, before it continues reading
+    from `stream`.
+    """
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix, b''
+            return data + self.stream.read()
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+    def readline(self, size=None):
+        if size is None:
+            size = -1
+        if not self.prefix:
+            return self.stream.readline(size)
+        if size == 0:
+            return b''
+        end = self.prefix.find(b'\n') + 1
+        if 0 <= size < (end or len(self.prefix) + 1):
+            end = size
+        if end:
+            data, self.prefix = self.prefix[:end], self.prefix[end:]
+            return data
+        data, self.prefix = self.prefix, b''
+        if size < 0:
+            return data + self.stream.readline()
+        return data + self.stream.readline(size - len(data))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+
+def _find_urlencoded(data, name, boundary, complete):
+    key = name.encode('ascii') + b'='
+    start = 0
+    while True:
+        index = data.find(key, start)
+        if index == -1:
+            return None if complete else _need_more
+        if index == 0 or data[index - 1:index] == b'&':
+            break
+        start = index + 1
+    value_start = index + len(key)
+    value_end = data.find(b'&', value_start)
+    if value_end == -1:
+        if not complete:
+            return _need_more
+        value_end = len(data)
+    return url_unquote_plus(data[value_start:value_end])
+
+
+def _find_multipart(data, name, boundary, complete):
+    # Only the first part is considered, any other would require us to read
+    # past the contents of the parts before it.
+    delimiter = b'--' + boundary
+    start = len(delimiter) + 2
+    if len(data) < start:
+        return None if complete else _need_more
+    if data[:start] != delimiter + b'\r\n':
+        return None
+    headers_end = data.find(b'\r\n\r\n', start)
+    if headers_end == -1:
+        return None if complete else _need_more
+    for header in data[start:headers_end].split(b'\r\n'):
+        header_name, _, header_value = header.partition(b':')
+        if header_name.strip().lower() == b'content-disposition':
+            _, options = parse_options_header(header_value.decode('latin1'))
+            if options.get('name') != name:
+                return None
+            break
+    else:
+        return None
+    value_end = data.find(b'\r\n' + delimiter, headers_end + 4)
+    if value_end == -1:
+        return None if complete else _need_more
+    return data[headers_end + 4:value_end].decode('utf-8', 'replace')
+
+
+def peek_form_field(environ, name, limit=4096, chunk_size=512):
+    """
+    Returns the value of the form field called `name` from the body of the
+    request described by `environ`, by reading no more than `limit` bytes of
+    it.
+
+    In urlencoded bodies the field may appear anywhere within the first
+    `limit` bytes, in multipart bodies it has to be the first part. Returns
+    `None` if the field has not been found.
+
+    The bytes that have been read are put in front of ``wsgi.input`` again,
+    so that the body can be parsed as usual afterwards. Reading stops as soon
+    as the field is found.
+    """
+    mimetype, options = parse_options_header(environ.get('CONTENT_TYPE', ''))
+    if mimetype == 'application/x-www-form-urlencoded':
+        find = _find_urlencoded
+        boundary = None
+    elif mimetype == 'multipart/form-data' and options.get('boundary'):
+        find = _find_multipart
+        boundary = options['boundary'].encode('latin1')
+    else:
+        return None
+    try:
+        content_length = int(environ.get('CONTENT_LENGTH') or '')
+    except ValueError:
+        return None
+    limit = min(limit, content_length)
+    stream = environ['wsgi.input']
+    data = b''
+    result = _need_more
+    while len(data) < limit:
+        chunk = stream.read(min(chunk_size, limit - len(data)))
+        if not chunk:
+            break
+        data += chunk
+        result = find(data, name, boundary, len(data) == content_length)
+        if result is not _need_more:
+            break
+    environ['wsgi.input'] = ReplayStream(data, stream)
+    if result is _need_more:
+        return None
+    return result
@@ -32,6 +32,35 @@ def view_coverage():
     run('open htmlcov/index.html')
 
 
+BENCHMARK_COMMAND = (
+    'py.test benchmarks/bench_*.py '
+    '--benchmark-storage=benchmarks/results --benchmark-sort=name'
+)
+
+
+@task
+def bench():
+    run(BENCHMARK_COMMAND)
+
+
+@task
+def bench_baseline():
+    run(BENCHMARK_COMMAND + ' --benchmark-save=baseline')
+
+
+@task
+def bench_compare():
+    run(
+        BENCHMARK_COMMAND +
+        ' --benchmark-compare --benchmark-compare-fail=median:10%'
+    )
+
+
+@task
+def loadtest():
+    run('python benchmarks/loadtest.py')
+
+
 @task
 def docs():
     run('make -C docs html')
@@ -0,0 +1,109 @@
+# coding: utf-8
+"""
+    tests.test_asyncsupport
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import sys
+
+import flask
+import pytest
+
+from flask.ext.relief import Relief, WebForm, Text
+from flask.ext.relief.signals import csrf_checked
+
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 5), reason='requires Python 3.5 or later'
+)
+
+
+def run(coroutine):
+    import asyncio
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class TestRelief(object):
+    @pytest.fixture
+    def async_app(self, app):
+        extension = Relief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        @extension.csrf_policy('async')
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            # The before request function must not have parsed the form.
+            assert 'form' not in flask.request.__dict__
+            run(extension.check_csrf_token_async())
+            return u'success'
+
+        return app
+
+    def test_check_csrf_token_async(self, async_app):
+        checks = []
+
+        def receiver(sender, outcome, timings):
+            checks.append(outcome)
+
+        with csrf_checked.connected_to(receiver, async_app):
+            with async_app.test_client() as client:
+                csrf_token = client.get('/').data
+                data = {'csrf_token': csrf_token}
+                with client.post('/', data=data) as response:
+                    assert response.status_code == 200
+                    assert response.data == b'success'
+                headers = {'X-RELIEF-CSRF-Token': csrf_token}
+                with client.post('/', headers=headers) as response:
+                    assert response.status_code == 200
+        assert checks == ['accepted', 'accepted']
+
+    @pytest.mark.parametrize('data', [{}, {'csrf_token': u'foo'}])
+    def test_check_csrf_token_async_invalid(self, async_app, data):
+        with async_app.test_client() as client:
+            client.get('/')
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+
+    def test_check_csrf_token_async_other_policy(self, app):
+        extension = Relief(app)
+
+        @app.route('/', methods=['POST'])
+        @extension.exempt
+        def index():
+            run(extension.check_csrf_token_async())
+            return u'success'
+
+        with app.test_client() as client:
+            with client.post('/') as response:
+                assert response.status_code == 200
+
+
+class TestWebForm(object):
+    def test_set_and_validate_on_submit_async(self, app):
+        Relief(app)
+
+        class Form(WebForm):
+            foo = Text
+
+        with app.test_request_context(method='POST', data={'foo': u'bar'}):
+            form = Form()
+            assert run(form.set_and_validate_on_submit_async())
+            assert form.value['foo'] == u'bar'
+
+    def test_set_and_validate_on_submit_async_no_teardown(self, app):
+        Relief(app)
+        teardowns = []
+        app.teardown_request(teardowns.append)
+
+        class Form(WebForm):
+            foo = Text
+
+        with app.test_request_context(method='POST', data={'foo': u'bar'}):
+            form = Form()
+            assert run(form.set_and_validate_on_submit_async())
+            assert not teardowns
+            assert flask.request.form['foo'] == u'bar'
+        assert teardowns == [None]
@@ -6,10 +6,14 @@
     :copyright: 2013 by Daniel Neuhäuser
     :license: BSD, see LICENSE.rst for details
 """
+from base64 import urlsafe_b64encode
+
 import pytest
 
 from flask.ext.relief.crypto import (
-    mask_secret, unmask_secret, encrypt_once, decrypt_once, constant_time_equal
+    mask_secret, unmask_secret, encrypt_once, decrypt_once,
+    constant_time_equal, xor_bytes, mask_secrets, unmask_secrets,
+    masked_secret_length
 )
 from flask.ext.relief._compat import text_type
 
@@ -35,6 +39,89 @@ def test_unmask_secret(secret):
     assert isinstance(unmasked, secret.__class__)
 
 
+@pytest.mark.parametrize('secret', [
+    u'foo', b'foo', u'', b'x' * 100
+])
+def test_mask_secret_compact(secret):
+    masked = mask_secret(secret, compact=True)
+    assert isinstance(masked, text_type)
+    assert masked.startswith(u'_')
+    assert len(masked) <= len(mask_secret(secret))
+    unmasked = unmask_secret(masked)
+    assert unmasked == secret
+    assert isinstance(unmasked, secret.__class__)
+
+
+def test_unmask_secret_compact_bad_version():
+    masked = urlsafe_b64encode(b'\xfd' + b'\x00' * 8).decode('ascii')
+    assert masked.startswith(u'_')
+    with pytest.raises(TypeError):
+        unmask_secret(masked)
+    with pytest.raises(TypeError):
+        unmask_secret(u'_a')
+
+
+@pytest.mark.parametrize('masked_secret', [
+    u'', u'a', u'aa', u'aaaaaa', u'_', u'_aa', u'_aaaa', u'_a%^&b', u'xxxx',
+    u'\xe4\xe4\xe4\xe4', u'_\xe4aa'
+])
+def test_unmask_secret_invalid(masked_secret):
+    with pytest.raises(TypeError):
+        unmask_secret(masked_secret)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_unmask_secret_max_length(compact):
+    masked = mask_secret(u'foo', compact=compact)
+    assert unmask_secret(masked, max_length=len(masked)) == u'foo'
+    with pytest.raises(TypeError):
+        unmask_secret(masked, max_length=len(masked) - 1)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_masked_secret_length(compact):
+    for length in range(10):
+        masked = mask_secret(u'a' * length, compact=compact)
+        assert masked_secret_length(length, compact=compact) == len(masked)
+
+
+def test_mask_secrets():
+    secrets = [u'foo', b'bar', u'', b'spam' * 10]
+    masked = mask_secrets(secrets)
+    assert len(masked) == len(secrets)
+    for secret, masked_secret in zip(secrets, masked):
+        assert isinstance(masked_secret, text_type)
+        assert len(masked_secret) == len(mask_secret(secret))
+        assert unmask_secret(masked_secret) == secret
+    assert mask_secrets([]) == []
+
+    masked = mask_secrets(secrets, compact=True)
+    for secret, masked_secret in zip(secrets, masked):
+        assert len(masked_secret) == len(mask_secret(secret, compact=True))
+        assert unmask_secret(masked_secret) == secret
+
+
+def test_unmask_secrets():
+    secrets = [u'foo', b'bar']
+    assert unmask_secrets(mask_secrets(secrets)) == secrets
+    with pytest.raises(TypeError):
+        unmask_secrets([mask_secret(u'foo'), u'asd'])
+
+
+@pytest.mark.parametrize('buffer_type', [bytes, bytearray])
+def test_xor_bytes(buffer_type):
+    a = buffer_type(b'\x00\x0f\xf0\xff')
+    b = buffer_type(b'\xff\xff\x00\x0f')
+    assert xor_bytes(a, b) == b'\xff\xf0\xf0\xf0'
+    assert xor_bytes(a, buffer_type(b'\xff')) == b'\xff'
+    assert xor_bytes(a, buffer_type(b'')) == b''
+
+
+def test_mask_secret_bytearray():
+    secret = bytearray(b'foo' * 1000)
+    assert unmask_secret(mask_secret(secret)) == bytes(secret)
+
+
 def test_encrypt_once():
     plaintext = b'foobar'
     key, ciphertext = encrypt_once(plaintext)
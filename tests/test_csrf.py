@@ -6,10 +6,18 @@
     :copyright: 2013 by Daniel Neuhäuser
     :license: BSD, see LICENSE.rst for details
 """
+import hashlib
+
 import pytest
 from flask import session
+from itsdangerous import TimestampSigner
 
-from flask.ext.relief.csrf import generate_csrf_token, touch_csrf_token
+from flask.ext.relief.csrf import (
+    generate_csrf_token, touch_csrf_token, TokenReservoir,
+    CSRF_TOKEN_CHARACTERS, generate_signed_csrf_token,
+    check_signed_csrf_token, dump_cookie_csrf_token, load_cookie_csrf_token,
+    SIGNED_CSRF_TOKEN_LENGTH
+)
 
 
 def test_generate_csrf_token():
@@ -17,6 +25,41 @@ def test_generate_csrf_token():
     assert len(token) == 20
     assert len(generate_csrf_token(length=1)) == 1
     assert generate_csrf_token(alphabet=u'1') == u'1' * 20
+    assert generate_csrf_token(length=0) == u''
+
+
+def test_generate_csrf_token_uses_whole_alphabet():
+    characters = set(generate_csrf_token(length=10000))
+    assert characters == set(CSRF_TOKEN_CHARACTERS)
+
+
+def test_generate_csrf_token_large_alphabet():
+    alphabet = u'ab' * 200
+    token = generate_csrf_token(alphabet=alphabet)
+    assert len(token) == 20
+    assert set(token) <= set(alphabet)
+
+
+class TestTokenReservoir(object):
+    def test_get(self):
+        reservoir = TokenReservoir(size=10, length=5)
+        tokens = [reservoir.get() for _ in range(20)]
+        assert all(len(token) == 5 for token in tokens)
+        assert len(set(tokens)) == 20
+
+    def test_fill(self):
+        reservoir = TokenReservoir(size=10)
+        reservoir.fill()
+        assert len(reservoir._tokens) == 10
+        token = reservoir._tokens[0]
+        assert reservoir.get() == token
+
+    def test_discards_tokens_after_fork(self):
+        reservoir = TokenReservoir(size=10)
+        reservoir.fill()
+        token = reservoir._tokens[0]
+        reservoir._pid = -1
+        assert reservoir.get() != token
 
 
 @pytest.mark.usefixtures('request_context')
@@ -26,3 +69,58 @@ def test_touch_csrf_token(app):
     assert session['_csrf_token'] == token
     touch_csrf_token()
     assert session['_csrf_token'] == token
+
+
+@pytest.mark.usefixtures('request_context')
+def test_touch_csrf_token_generate(app):
+    assert touch_csrf_token(generate=lambda: u'foo') == u'foo'
+    assert session['_csrf_token'] == u'foo'
+
+
+def test_cookie_csrf_token():
+    value = dump_cookie_csrf_token(u'foo', b'secret')
+    assert load_cookie_csrf_token(value, b'secret') == u'foo'
+    assert load_cookie_csrf_token(value, b'other secret') is None
+    assert load_cookie_csrf_token(u'foo', b'secret') is None
+    assert load_cookie_csrf_token(value[:-1], b'secret') is None
+
+
+class TestSignedCSRFToken(object):
+    def test_generate(self):
+        token = generate_signed_csrf_token(b'secret')
+        assert len(token) == SIGNED_CSRF_TOKEN_LENGTH
+        assert token != generate_signed_csrf_token(b'other')
+        assert token != generate_signed_csrf_token(b'secret', binding=u'foo')
+
+    def test_check(self):
+        token = generate_signed_csrf_token(b'secret', binding=u'foo')
+        assert check_signed_csrf_token(token, b'secret', 60, binding=u'foo')
+        assert not check_signed_csrf_token(token, b'other', 60, binding=u'foo')
+        assert not check_signed_csrf_token(token, b'secret', 60)
+        assert not check_signed_csrf_token(token[:-1], b'secret', 60,
+                                           binding=u'foo')
+        assert not check_signed_csrf_token(u'foo', b'secret', 60)
+        assert not check_signed_csrf_token(b'foo', b'secret', 60)
+        assert not check_signed_csrf_token(u'\xe4' * 10, b'secret', 60)
+
+    def test_check_salted(self):
+        # A timestamp signed for anything else with the same key, is not a
+        # valid token.
+        signer = TimestampSigner(b'secret', digest_method=hashlib.sha256)
+        token = signer.sign(b'foo').decode('ascii').split(u'.', 1)[1]
+        assert not check_signed_csrf_token(token, b'secret', 60, binding=u'foo')
+
+    def test_check_binding_with_separator(self):
+        token = generate_signed_csrf_token(b'secret', binding=u'foo.bar')
+        assert check_signed_csrf_token(
+            token, b'secret', 60, binding=u'foo.bar'
+        )
+        assert not check_signed_csrf_token(
+            token, b'secret', 60, binding=u'foo'
+        )
+
+    def test_check_expired(self):
+        token = generate_signed_csrf_token(b'secret', timestamp=1000)
+        assert check_signed_csrf_token(token, b'secret', 60, now=1060)
+        assert not check_signed_csrf_token(token, b'secret', 60, now=1061)
+        assert not check_signed_csrf_token(token, b'secret', 60, now=999)
@@ -0,0 +1,70 @@
+# coding: utf-8
+"""
+    tests.test_entropy
+    ~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import gc
+import weakref
+
+import pytest
+
+from flask.ext.relief.entropy import EntropyPool, PooledRandom, urandom
+
+
+class TestEntropyPool(object):
+    def test_read(self):
+        pool = EntropyPool(size=64)
+        reads = [pool.read(16) for _ in range(10)]
+        assert all(len(read) == 16 for read in reads)
+        assert len(set(reads)) == 10
+
+    def test_read_larger_than_size(self):
+        pool = EntropyPool(size=8)
+        assert len(pool.read(32)) == 32
+
+    def test_refill(self):
+        pool = EntropyPool(size=16)
+        first = pool.read(16)
+        buffer = pool._buffer
+        second = pool.read(1)
+        assert pool._buffer is not buffer
+        assert len(first) == 16
+        assert len(second) == 1
+
+    def test_refill_after_fork(self):
+        pool = EntropyPool(size=64)
+        pool.read(1)
+        buffer = pool._buffer
+        pool._pid = -1
+        pool.read(1)
+        assert pool._buffer is not buffer
+
+    def test_freed(self):
+        pool = weakref.ref(EntropyPool())
+        gc.collect()
+        assert pool() is None
+
+
+class TestPooledRandom(object):
+    def test_choice(self):
+        random = PooledRandom(EntropyPool())
+        assert all(random.choice(u'ab') in u'ab' for _ in range(100))
+        assert set(random.choice(u'ab') for _ in range(100)) == set(u'ab')
+
+    def test_random(self):
+        random = PooledRandom(EntropyPool())
+        assert all(0 <= random.random() < 1 for _ in range(100))
+
+    def test_getrandbits(self):
+        random = PooledRandom(EntropyPool())
+        assert all(0 <= random.getrandbits(3) < 8 for _ in range(100))
+        with pytest.raises(ValueError):
+            random.getrandbits(0)
+
+
+def test_urandom():
+    assert len(urandom(10)) == 10
+    assert urandom(10) != urandom(10)
@@ -7,19 +7,25 @@
     :license: BSD, see LICENSE.rst for details
 """
 from __future__ import print_function
-from itertools import chain, combinations
+from itertools import chain, combinations, count
 
 import pytest
 import flask
 import relief
 from relief.validation import IsFalse, IsTrue
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from werkzeug.datastructures import (
+    ImmutableMultiDict, ImmutableOrderedMultiDict
+)
 from selenium.common.exceptions import ElementNotVisibleException
 
 import flask.ext.relief
 from flask.ext.relief import (
-    Secret, WebForm, Text, Email, Password, Hidden, Checkbox, Choice,
+    Relief, Secret, WebForm, Text, Email, Password, Hidden, Checkbox, Choice,
     MultipleChoice, Submit, Option, OptGroup, Select
 )
+from flask.ext.relief.crypto import mask_secret, unmask_secret
+from flask.ext.relief.signals import csrf_checked, form_submitted
 
 
 def submit_form(browser):
@@ -59,6 +65,21 @@ class TestSecret(object):
         assert second_element.raw_value == element.raw_value
         assert second_element.value == u'foobar'
 
+    def test_compact_serialization(self):
+        element = Secret.using(compact=True)()
+        element.set_from_native(u'foobar')
+        assert element.raw_value.startswith(u'_')
+
+        second_element = Secret(element.raw_value)
+        assert second_element.value == u'foobar'
+
+    def test_unserialize_invalid(self):
+        element = Secret.using(max_masked_length=16)()
+        element.set_from_raw(mask_secret(u'foobar'))
+        assert element.value is relief.NotUnserializable
+        element.set_from_raw(u'ab' * 4)
+        assert element.value is relief.NotUnserializable
+
 
 class TestRelief(object):
     @pytest.fixture
@@ -96,9 +117,497 @@ class TestRelief(object):
             with client.post('/', data={'csrf_token': u'asd'}) as response:
                 assert response.status_code == 400
 
+            with client.post('/', data={'csrf_token': u'a' * len(csrf_token)}) as response:
+                assert response.status_code == 400
+
+            with client.post('/', data={'csrf_token': csrf_token * 2}) as response:
+                assert response.status_code == 400
+
             for _ in range(10):
                 assert client.get('/').data != csrf_token
 
+    def test_safe_methods_do_not_touch_session(self, app, extension):
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            return u'success'
+
+        with app.test_client() as client:
+            with client.get('/') as response:
+                assert response.status_code == 200
+                assert 'Set-Cookie' not in response.headers
+                assert '_csrf_token' not in flask.session
+
+            with client.post('/') as response:
+                assert response.status_code == 400
+                assert 'Set-Cookie' not in response.headers
+
+    def test_lazy_context_injection(self, app, extension):
+        @app.route('/')
+        def index():
+            return flask.render_template_string(u'foo')
+
+        @app.route('/twice')
+        def twice():
+            return flask.render_template_string(u'{{ csrf_token }}') + u' ' + \
+                flask.render_template_string(u'{{ csrf_token }}')
+
+        with app.test_client() as client:
+            with client.get('/') as response:
+                assert response.data == b'foo'
+                assert 'Set-Cookie' not in response.headers
+                assert '_csrf_token' not in flask.session
+
+            first, second = client.get('/twice').data.decode('ascii').split()
+            assert first != second
+            assert unmask_secret(first) == unmask_secret(second)
+            assert unmask_secret(first) == flask.session['_csrf_token']
+
+    def test_get_csrf_token(self, app, extension):
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            return extension.get_csrf_token()
+
+        with app.test_client() as client:
+            csrf_token = client.get('/').data
+            assert flask.session['_csrf_token'] == csrf_token.decode('ascii')
+            assert client.get('/').data == csrf_token
+
+    def test_csrf_policy(self, app, extension):
+        admin = flask.Blueprint('admin', __name__)
+        api = extension.exempt(flask.Blueprint('api', __name__))
+
+        @app.route('/exempt', methods=['POST'])
+        @extension.exempt
+        def exempt():
+            return u'success'
+
+        @app.route('/header', methods=['POST'])
+        @extension.csrf_policy('header-only')
+        def header():
+            return u'success'
+
+        @app.route('/form', methods=['POST'])
+        @extension.csrf_policy('form-only')
+        def form():
+            return u'success'
+
+        @app.route('/token')
+        def token():
+            return flask.render_template_string(u'{{ csrf_token }}')
+
+        @admin.route('/admin', methods=['POST'])
+        def admin_index():
+            return u'success'
+
+        @api.route('/api', methods=['POST'])
+        def api_index():
+            return u'success'
+
+        app.register_blueprint(admin)
+        app.register_blueprint(api)
+        app.config['RELIEF_CSRF_BLUEPRINT_POLICIES'] = {'admin': 'exempt'}
+
+        with app.test_client() as client:
+            for url in ['/exempt', '/admin', '/api']:
+                with client.post(url) as response:
+                    assert response.status_code == 200
+                    assert 'Set-Cookie' not in response.headers
+
+            csrf_token = client.get('/token').data
+            headers = {'X-RELIEF-CSRF-Token': csrf_token}
+            data = {'csrf_token': csrf_token}
+            with client.post('/header', headers=headers) as response:
+                assert response.status_code == 200
+            with client.post('/header', data=data) as response:
+                assert response.status_code == 400
+            with client.post('/form', data=data) as response:
+                assert response.status_code == 200
+            with client.post('/form', headers=headers) as response:
+                assert response.status_code == 400
+
+        policies = app.extensions['relief_csrf_policies']
+        assert policies['exempt'] == 'exempt'
+        assert policies['token'] == 'default'
+
+    def test_csrf_policy_precedence(self, app, extension):
+        admin = extension.exempt(flask.Blueprint('admin', __name__))
+
+        @admin.route('/view', methods=['POST'])
+        @extension.csrf_policy('header-only')
+        def view():
+            return u'success'
+
+        @admin.route('/config', methods=['POST'])
+        @extension.exempt
+        def config():
+            return u'success'
+
+        @admin.route('/blueprint', methods=['POST'])
+        def blueprint():
+            return u'success'
+
+        app.register_blueprint(admin)
+        app.config['RELIEF_CSRF_POLICIES'] = {'admin.config': 'form-only'}
+        app.config['RELIEF_CSRF_BLUEPRINT_POLICIES'] = {'admin': 'default'}
+        with app.test_client() as client:
+            client.post('/blueprint')
+        policies = app.extensions['relief_csrf_policies']
+        assert policies['admin.config'] == 'form-only'
+        assert policies['admin.view'] == 'header-only'
+        assert policies['admin.blueprint'] == 'default'
+
+    def test_csrf_policy_config(self, app, extension):
+        app.config['RELIEF_CSRF_POLICIES'] = {'index': 'exempt'}
+
+        @app.route('/', methods=['POST'])
+        def index():
+            return u'success'
+
+        with app.test_client() as client:
+            with client.post('/') as response:
+                assert response.status_code == 200
+
+    def test_static_endpoints_exempt(self, app, extension):
+        with app.test_client() as client:
+            url = '/static/relief/jquery-csrf.js'
+            for method in ['GET', 'OPTIONS']:
+                with client.open(url, method=method) as response:
+                    assert response.status_code == 200
+                    assert 'Set-Cookie' not in response.headers
+        policies = app.extensions['relief_csrf_policies']
+        assert policies['relief.static'] == 'exempt'
+
+    def test_view_named_static_not_exempt(self, app, extension):
+        admin = flask.Blueprint('admin', __name__)
+
+        @admin.route('/delete', methods=['POST'])
+        def static():
+            return u'success'
+
+        app.register_blueprint(admin)
+        with app.test_client() as client:
+            with client.post('/delete') as response:
+                assert response.status_code == 400
+        policies = app.extensions['relief_csrf_policies']
+        assert policies['admin.static'] == 'default'
+
+    def test_safe_methods_not_recorded(self, app, extension):
+        checks = []
+
+        def receiver(sender, outcome, timings):
+            checks.append(outcome)
+
+        with csrf_checked.connected_to(receiver, app):
+            with app.test_client() as client:
+                for method in ['GET', 'HEAD']:
+                    url = '/static/relief/jquery-csrf.js'
+                    with client.open(url, method=method) as response:
+                        assert response.status_code == 200
+        assert checks == []
+
+    def test_early_rejection(self, csrf_app):
+        csrf_app.config['RELIEF_CSRF_HEADER_FIRST'] = True
+        csrf_app.config['RELIEF_CSRF_MAX_FORM_CONTENT_LENGTH'] = 1024
+        with csrf_app.test_client() as client:
+            csrf_token = client.get('/').data
+            data = {'csrf_token': csrf_token, 'foo': u'a' * 2048}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+                assert 'form' not in flask.request.__dict__
+
+            headers = {'X-RELIEF-CSRF-Token': csrf_token}
+            with client.post('/', data=data, headers=headers) as response:
+                assert response.status_code == 200
+                assert 'form' not in flask.request.__dict__
+
+            with client.post('/', data={'csrf_token': csrf_token}) as response:
+                assert response.status_code == 200
+
+            with client.post('/', data=csrf_token) as response:
+                assert response.status_code == 400
+                assert 'form' not in flask.request.__dict__
+
+    @pytest.mark.parametrize(('max_length', 'status_code'), [
+        (None, 200),
+        (1024, 400)
+    ])
+    def test_early_rejection_without_content_length(self, csrf_app,
+                                                    max_length, status_code):
+        csrf_app.config['RELIEF_CSRF_MAX_FORM_CONTENT_LENGTH'] = max_length
+        with csrf_app.test_client() as client:
+            csrf_token = client.get('/').data
+            builder = EnvironBuilder(
+                path='/', method='POST', data={'csrf_token': csrf_token}
+            )
+            # Like a chunked request, whose length is not known in advance.
+            environ = builder.get_environ()
+            del environ['CONTENT_LENGTH']
+            environ['wsgi.input_terminated'] = True
+            client.cookie_jar.inject_wsgi(environ)
+            _, status, _ = run_wsgi_app(csrf_app, environ)
+            assert int(status.split()[0]) == status_code
+
+    def test_streaming(self, csrf_app):
+        csrf_app.config['RELIEF_CSRF_STREAMING'] = True
+        body = (
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="csrf_token"\r\n\r\n'
+            b'%s\r\n'
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="upload"; '
+            b'filename="a.txt"\r\n\r\n' +
+            b'a' * 100000 + b'\r\n'
+            b'--boundary--\r\n'
+        )
+        content_type = 'multipart/form-data; boundary=boundary'
+
+        @csrf_app.route('/upload', methods=['POST'])
+        def upload():
+            return flask.request.files['upload'].read()
+
+        with csrf_app.test_client() as client:
+            csrf_token = client.get('/').data
+            with client.post('/upload', data=body.replace(b'%s', b'a' * 84),
+                             content_type=content_type) as response:
+                assert response.status_code == 400
+                assert 'form' not in flask.request.__dict__
+                assert len(flask.request.environ['wsgi.input'].prefix) < 4096
+
+            with client.post('/upload', data=body.replace(b'%s', csrf_token),
+                             content_type=content_type) as response:
+                assert response.status_code == 200
+                assert response.data == b'a' * 100000
+
+    def test_unknown_csrf_policy(self, extension):
+        with pytest.raises(ValueError):
+            extension.csrf_policy('foo')
+
+    def test_compact_csrf_token(self, csrf_app):
+        csrf_app.config['RELIEF_CSRF_COMPACT_TOKENS'] = True
+        with csrf_app.test_client() as client:
+            csrf_token = client.get('/').data
+            assert csrf_token.startswith(b'_')
+            with client.post('/', data={'csrf_token': csrf_token}) as response:
+                assert response.status_code == 200
+
+    def test_csrf_token_reservoir(self, app):
+        app.config['RELIEF_CSRF_TOKEN_RESERVOIR_SIZE'] = 10
+        extension = flask.ext.relief.Relief(app)
+        assert extension.token_reservoir.size == 10
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            return flask.render_template_string(u'{{ csrf_token }}')
+
+        with app.test_client() as client:
+            csrf_token = client.get('/').data
+            with client.post('/', data={'csrf_token': csrf_token}) as response:
+                assert response.status_code == 200
+
+    def test_stateless_csrf_checking(self, app):
+        class BoundRelief(flask.ext.relief.Relief):
+            def get_csrf_binding(self):
+                return flask.request.args.get('user', u'')
+
+        app.config['RELIEF_CSRF_STATELESS'] = True
+        BoundRelief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            return u'success'
+
+        with app.test_client() as client:
+            csrf_token = client.get('/?user=foo').data
+            assert '_csrf_token' not in flask.session
+            data = {'csrf_token': csrf_token}
+            with client.post('/?user=foo', data=data) as response:
+                assert response.status_code == 200
+                assert response.data == b'success'
+                assert 'Set-Cookie' not in response.headers
+            with client.post('/?user=bar', data=data) as response:
+                assert response.status_code == 400
+
+            with client.post('/?user=foo') as response:
+                assert response.status_code == 400
+
+            for forged_token in [u'a' * 52, b'a' * 52]:
+                data = {'csrf_token': mask_secret(forged_token)}
+                with client.post('/?user=foo', data=data) as response:
+                    assert response.status_code == 400
+
+    def test_stateless_csrf_without_binding(self, app):
+        app.config['RELIEF_CSRF_STATELESS'] = True
+        with pytest.raises(ValueError):
+            Relief(app)
+
+    def test_double_submit_csrf_checking(self, app):
+        app.config['RELIEF_CSRF_DOUBLE_SUBMIT'] = True
+        extension = Relief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            return u'success'
+
+        @app.route('/reset_token')
+        def reset_token():
+            extension.reset_csrf_token()
+            return u''
+
+        with app.test_client() as client:
+            with client.get('/') as response:
+                csrf_token = response.data
+                cookies = response.headers.getlist('Set-Cookie')
+            assert len(cookies) == 1
+            assert cookies[0].startswith('relief_csrf_token=')
+            assert 'HttpOnly' in cookies[0]
+            # The cookie is only set, when the token is created.
+            with client.get('/') as response:
+                assert 'Set-Cookie' not in response.headers
+                second_csrf_token = response.data
+            assert second_csrf_token != csrf_token
+            for token in [csrf_token, second_csrf_token]:
+                data = {'csrf_token': token}
+                with client.post('/', data=data) as response:
+                    assert response.status_code == 200
+                    assert 'Set-Cookie' not in response.headers
+            data = {'csrf_token': mask_secret(u'a' * 20)}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+
+            client.get('/reset_token')
+            data = {'csrf_token': csrf_token}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+
+        with app.test_client() as client:
+            data = {'csrf_token': csrf_token}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+
+    def test_double_submit_reset_and_render(self, app):
+        app.config['RELIEF_CSRF_DOUBLE_SUBMIT'] = True
+        extension = Relief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            return flask.render_template_string(u'{{ csrf_token }}')
+
+        @app.route('/reset_token')
+        def reset_token():
+            extension.reset_csrf_token()
+            return flask.render_template_string(u'{{ csrf_token }}')
+
+        with app.test_client() as client:
+            revoked_csrf_token = client.get('/').data
+            with client.get('/reset_token') as response:
+                csrf_token = response.data
+                cookies = response.headers.getlist('Set-Cookie')
+            assert len(cookies) == 1
+            assert 'Expires=Thu, 01-Jan-1970' not in cookies[0]
+            assert unmask_secret(csrf_token) != \
+                unmask_secret(revoked_csrf_token)
+            data = {'csrf_token': revoked_csrf_token}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 400
+            data = {'csrf_token': csrf_token}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 200
+
+    @pytest.mark.parametrize(('origin_check', 'headers', 'with_token', 'status_code'), [
+        ('strict', {'Origin': 'http://evil.example'}, True, 400),
+        ('strict', {'Referer': 'http://evil.example/'}, True, 400),
+        ('strict', {'Origin': 'null'}, True, 400),
+        ('strict', {'Origin': 'http://localhost'}, False, 400),
+        ('strict', {'Origin': 'http://localhost'}, True, 200),
+        ('strict', {'Referer': 'http://localhost/foo?bar'}, True, 200),
+        ('strict', {'Origin': 'https://Partner.example'}, True, 200),
+        ('strict', {}, True, 200),
+        ('allow', {'Origin': 'http://localhost'}, False, 200),
+        ('allow', {'Referer': 'http://localhost/foo'}, False, 200),
+        ('allow', {'Origin': 'https://partner.example'}, False, 200),
+        ('allow', {'Origin': 'http://evil.example'}, False, 400),
+        ('allow', {'Origin': 'http://evil.example'}, True, 200),
+        ('allow', {}, False, 400)
+    ])
+    def test_csrf_origin_check(self, app, origin_check, headers, with_token,
+                               status_code):
+        app.config['RELIEF_CSRF_ORIGIN_CHECK'] = origin_check
+        app.config['RELIEF_CSRF_TRUSTED_ORIGINS'] = ['https://partner.example/']
+        Relief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            return u'success'
+
+        with app.test_client() as client:
+            csrf_token = client.get('/').data
+            data = {'csrf_token': csrf_token} if with_token else {}
+            with client.post('/', data=data, headers=headers) as response:
+                assert response.status_code == status_code
+
+    def test_unknown_csrf_origin_check(self, app):
+        app.config['RELIEF_CSRF_ORIGIN_CHECK'] = 'foo'
+        with pytest.raises(ValueError):
+            Relief(app)
+
+    def test_server_timing(self, app):
+        app.config['RELIEF_SERVER_TIMING'] = True
+        Relief(app)
+
+        class SomeForm(WebForm):
+            foo = relief.Unicode
+
+        timings = []
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            SomeForm().set_and_validate_on_submit()
+            timings.append(sorted(flask.g.relief_timings))
+            return u'success'
+
+        with app.test_client() as client:
+            with client.get('/') as response:
+                csrf_token = response.data
+                assert response.headers['Server-Timing'].startswith(
+                    'relief-csrf-token;dur='
+                )
+            data = {'csrf_token': csrf_token, 'foo': u'bar'}
+            with client.post('/', data=data) as response:
+                assert response.status_code == 200
+                server_timing = response.headers['Server-Timing']
+        names = [
+            'relief-csrf-compare', 'relief-csrf-extract',
+            'relief-csrf-session', 'relief-csrf-unmask', 'relief-form-bind',
+            'relief-form-parse', 'relief-form-validate'
+        ]
+        assert timings == [names]
+        assert [
+            metric.split(';')[0] for metric in server_timing.split(', ')
+        ] == names
+
+    def test_server_timing_sample_rate(self, app):
+        app.config['RELIEF_SERVER_TIMING'] = True
+        app.config['RELIEF_SERVER_TIMING_SAMPLE_RATE'] = 0
+        Relief(app)
+
+        @app.route('/')
+        def index():
+            assert not hasattr(flask.g, 'relief_timings')
+            return flask.render_template_string(u'{{ csrf_token }}')
+
+        with app.test_client() as client:
+            with client.get('/') as response:
+                assert response.status_code == 200
+                assert 'Server-Timing' not in response.headers
+
     def test_reset_csrf_token(self, extension, csrf_app):
         @csrf_app.route('/reset_token')
         def reset_token():
@@ -111,6 +620,70 @@ class TestRelief(object):
             with client.post('/', data={'csrf_token': csrf_token}) as response:
                 assert response.status_code == 400
 
+    def test_reset_csrf_token_without_token(self, extension, csrf_app):
+        @csrf_app.route('/reset_token')
+        def reset_token():
+            extension.reset_csrf_token()
+            return u''
+
+        with csrf_app.test_client() as client:
+            with client.get('/reset_token') as response:
+                assert response.status_code == 200
+
+    def test_csrf_checked_signal(self, csrf_app):
+        checks = []
+
+        def receiver(sender, outcome, timings):
+            checks.append((outcome, sorted(timings)))
+
+        with csrf_checked.connected_to(receiver, csrf_app):
+            with csrf_app.test_client() as client:
+                client.post('/')
+                csrf_token = client.get('/').data
+                client.post('/', data={'csrf_token': csrf_token})
+                client.post('/')
+                client.post('/', data={'csrf_token': u'asd'})
+                client.post('/', data={'csrf_token': mask_secret(u'a' * 20)})
+        assert checks == [
+            ('mismatch', ['session']),
+            ('accepted', ['compare', 'extract', 'session', 'unmask']),
+            ('missing_token', ['extract', 'session']),
+            ('bad_encoding', ['extract', 'session', 'unmask']),
+            ('mismatch', ['compare', 'extract', 'session', 'unmask'])
+        ]
+
+    def test_metrics(self, app):
+        app.config['RELIEF_METRICS'] = True
+        app.config['RELIEF_METRICS_URL'] = '/metrics'
+        extension = Relief(app)
+
+        @app.route('/webhook', methods=['POST'])
+        @extension.exempt
+        def webhook():
+            return u'success'
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            return u'success'
+
+        with app.test_client() as client:
+            csrf_token = client.get('/').data
+            client.post('/', data={'csrf_token': csrf_token})
+            client.post('/')
+            client.post('/webhook')
+            with client.get('/metrics') as response:
+                assert response.status_code == 200
+                assert response.mimetype == 'text/plain'
+                lines = response.data.decode('utf-8').splitlines()
+        assert 'relief_csrf_checks_total{outcome="accepted"} 1.0' in lines
+        assert 'relief_csrf_checks_total{outcome="missing_token"} 1.0' in lines
+        # Only the webhook is exempt, safe methods are not recorded.
+        assert 'relief_csrf_checks_total{outcome="exempt"} 1.0' in lines
+        assert 'relief_csrf_stage_seconds_count{stage="session"} 2.0' in lines
+        assert 'relief_csrf_stage_seconds_count{stage="unmask"} 1.0' in lines
+
     def test_jquery_csrf_js(self, extension, app, serve, browser, jquery_url):
         @app.route('/', methods=['GET', 'POST'])
         def index():
@@ -171,6 +744,167 @@ class TestWebForm(object):
                 assert response.status_code == 200
                 assert response.data == b'True'
 
+    @pytest.mark.parametrize('parameter_storage_class', [
+        ImmutableMultiDict, ImmutableOrderedMultiDict
+    ])
+    def test_set_and_validate_on_submit_binding(self, app,
+                                                parameter_storage_class):
+        app.request_class = type(
+            'Request', (app.request_class, ),
+            {'parameter_storage_class': parameter_storage_class}
+        )
+
+        class SomeForm(WebForm):
+            foo = relief.Unicode
+            bar = relief.List.of(relief.Unicode)
+            baz = relief.Unicode
+
+        data = b'foo=spam&bar=a&bar=b&other=1&other=2'
+        with app.test_request_context(
+            method='POST', data=data,
+            content_type='application/x-www-form-urlencoded'
+        ):
+            form = SomeForm()
+            assert not form.set_and_validate_on_submit()
+            assert form.foo.value == u'spam'
+            assert form.bar.value == [u'a', u'b']
+            assert form.baz.raw_value is relief.Unspecified
+
+    def test_form_submitted_signal(self, app):
+        class SomeForm(WebForm):
+            foo = relief.Unicode
+
+        submissions = []
+
+        def receiver(sender, form, outcome, timings):
+            submissions.append((type(form), outcome, sorted(timings)))
+
+        @app.route('/', methods=['POST'])
+        def index():
+            return str(SomeForm().set_and_validate_on_submit())
+
+        with form_submitted.connected_to(receiver, app):
+            with app.test_client() as client:
+                client.post('/')
+                client.post('/', data={'foo': u'foo'})
+        stages = ['bind', 'parse', 'validate']
+        assert submissions == [
+            (SomeForm, 'invalid', stages), (SomeForm, 'valid', stages)
+        ]
+
+    def test_instantiation(self):
+        counter = count()
+        validated = []
+
+        class SomeForm(WebForm):
+            text = Text
+            secret = Secret
+            checkbox = Checkbox
+            preset = Text.using(default=u'foo')
+            factory = relief.Integer.using(
+                default_factory=lambda element: next(counter)
+            )
+            nested = relief.Form.of({'foo': relief.Unicode})
+            tags = relief.List.of(relief.Unicode)
+
+            def validate_text(self, element, context):
+                validated.append(self)
+                return element.value == u'spam'
+
+        forms = [SomeForm(), SomeForm()]
+        for form in forms:
+            assert form.is_valid is None
+            assert form.raw_value is relief.Unspecified
+            assert form.value is relief.NotUnserializable
+            for key in [u'text', u'secret', u'checkbox', u'preset']:
+                element = form[key]
+                assert getattr(form, key) is element
+                state = dict(element.__dict__)
+                state.pop('validators', None)
+                assert state == type(element)().__dict__
+            assert form.preset.value == u'foo'
+            assert form.nested.value is relief.NotUnserializable
+        assert forms[0].factory.value != forms[1].factory.value
+        assert forms[0].text is not forms[1].text
+        assert forms[0].text.errors is not forms[1].text.errors
+        assert forms[0].nested['foo'] is not forms[1].nested['foo']
+
+        forms[0].text.set_from_raw(u'spam')
+        forms[1].text.set_from_raw(u'eggs')
+        assert forms[0].text.validate()
+        assert not forms[1].text.validate()
+        assert validated == forms
+        # The validation methods are bound to each form, without changing the
+        # schema of the class.
+        assert SomeForm.member_schema['text'].validators == []
+
+    def test_instantiation_with_value(self):
+        class SomeForm(WebForm):
+            foo = Text
+            bar = Text.using(default=u'bar')
+
+        form = SomeForm({u'foo': u'spam', u'bar': u'eggs'})
+        assert form.value == {u'foo': u'spam', u'bar': u'eggs'}
+        assert SomeForm().bar.value == u'bar'
+
+    def test_instantiation_secret_default(self):
+        class SomeForm(WebForm):
+            foo = Secret.using(default=u'foo')
+
+        forms = [SomeForm(), SomeForm()]
+        for form in forms:
+            assert form.foo.value == u'foo'
+            assert unmask_secret(form.foo.raw_value) == u'foo'
+        # Each form has to mask the secret anew.
+        assert forms[0].foo.raw_value != forms[1].foo.raw_value
+
+    def test_instantiation_overridden_element(self):
+        counter = count()
+
+        class Counted(Text):
+            def serialize(self, value):
+                return u'%s-%d' % (value, next(counter))
+
+        class SomeForm(WebForm):
+            foo = Counted.using(default=u'foo')
+
+        assert SomeForm().foo.raw_value != SomeForm().foo.raw_value
+
+    def test_set_from_native_secrets(self):
+        class SomeForm(WebForm):
+            foo = Secret
+            bar = Secret
+            baz = Text
+
+        form = SomeForm()
+        form.set_from_native({u'foo': u'spam', u'bar': u'eggs', u'baz': u'x'})
+        assert form.value == {u'foo': u'spam', u'bar': u'eggs', u'baz': u'x'}
+        assert form.foo.raw_value != u'spam'
+        assert form.bar.raw_value != u'eggs'
+        assert form.baz.raw_value == u'x'
+
+        second_form = SomeForm()
+        second_form.set_from_raw(
+            dict((key, element.raw_value) for key, element in form.items())
+        )
+        assert second_form.value == form.value
+
+    def test_set_from_native_overridden_secret(self):
+        class UpperSecret(Secret):
+            def serialize(self, value):
+                if value is not relief.Unspecified:
+                    value = value.upper()
+                return super(UpperSecret, self).serialize(value)
+
+        class SomeForm(WebForm):
+            foo = Secret
+            bar = UpperSecret
+
+        form = SomeForm()
+        form.set_from_native({u'foo': u'spam', u'bar': u'eggs'})
+        assert unmask_secret(form.foo.raw_value) == u'spam'
+        assert unmask_secret(form.bar.raw_value) == u'EGGS'
+
 
 class TestText(object):
     @pytest.fixture
@@ -659,6 +1393,65 @@ class TestSelect(object):
         assert element.raw_value == u'baz'
         assert not element.validate()
 
+    def test_validate_optgroups(self):
+        element = Select.using(options=[
+            Option(u'foo'),
+            Option(u'bar', disabled=True),
+            OptGroup(u'Group', [Option(u'baz'), Option(u'qux', disabled=True)]),
+            OptGroup(u'Disabled', [Option(u'spam')], disabled=True)
+        ])()
+        for value in [u'foo', u'baz']:
+            element.set_from_raw(value)
+            assert element.value == value
+        for value in [u'bar', u'qux', u'spam', u'Group', [u'foo', u'baz']]:
+            element.set_from_raw(value)
+            assert element.value is relief.NotUnserializable
+
+    def test_validate_multiple(self):
+        element = Select.using(multiple=True, max_selected=3, options=[
+            Option(u'foo'),
+            Option(u'bar', disabled=True),
+            OptGroup(u'Group', [Option(u'baz'), Option(u'qux')])
+        ])()
+        for raw_value, value in [
+            (relief.Unspecified, set()),
+            (u'foo', set([u'foo'])),
+            ([u'foo', u'baz'], set([u'foo', u'baz'])),
+            ([u'foo', u'foo', u'baz'], set([u'foo', u'baz']))
+        ]:
+            element.set_from_raw(raw_value)
+            assert element.value == value
+        for raw_value in [
+            u'bar', [u'foo', u'bar'], [u'foo', u'spam'],
+            [u'foo', u'baz', u'qux', u'foo'], [[u'foo']]
+        ]:
+            element.set_from_raw(raw_value)
+            assert element.value is relief.NotUnserializable
+
+    def test_get_selectable_values(self):
+        options = [Option(u'foo'), OptGroup(u'Group', [Option(u'bar')])]
+        Foo = Select.using(options=options)
+        assert Foo().get_selectable_values() == frozenset([u'foo', u'bar'])
+        assert Foo().get_selectable_values() is Foo().get_selectable_values()
+        Bar = Foo.using(options=[Option(u'baz')])
+        assert Bar().get_selectable_values() == frozenset([u'baz'])
+        assert Foo().get_selectable_values() == frozenset([u'foo', u'bar'])
+
+    @pytest.mark.parametrize('multiple', [False, True])
+    def test_instance_options(self, multiple):
+        element = Select.using(
+            options=[Option(u'a')], multiple=multiple
+        )()
+        element.options = [Option(u'b')]
+        assert element.get_selectable_values() == frozenset([u'b'])
+        element.set_from_raw(u'a')
+        assert element.value is relief.NotUnserializable
+        element.set_from_raw(u'b')
+        assert element.value == (set([u'b']) if multiple else u'b')
+        # The options of the class are not affected.
+        other = Select.using(options=[Option(u'a')], multiple=multiple)()
+        assert other.get_selectable_values() == frozenset([u'a'])
+
     @pytest.mark.parametrize('selection', [u'foo', u'bar'])
     def test_single(self, make_select_app, serve, browser, selection):
         class Form(WebForm):
@@ -0,0 +1,101 @@
+# coding: utf-8
+"""
+    tests.test_metrics
+    ~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import os
+import shutil
+import tempfile
+from multiprocessing import Process
+
+import pytest
+
+from flask.ext.relief.metrics import (
+    Stopwatch, MemoryStorage, MmapStorage, Metrics, BUCKETS
+)
+
+
+@pytest.fixture
+def directory(request):
+    directory = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(directory))
+    return directory
+
+
+def test_stopwatch():
+    stopwatch = Stopwatch()
+    stopwatch.lap('foo')
+    stopwatch.lap('bar')
+    assert sorted(stopwatch.timings) == ['bar', 'foo']
+    assert all(timing >= 0 for timing in stopwatch.timings.values())
+
+
+def test_memory_storage():
+    storage = MemoryStorage(3)
+    storage.add(0, 1)
+    storage.add(2, 0.5)
+    storage.add(2, 0.5)
+    assert storage.collect() == [1.0, 0.0, 1.0]
+
+
+def add_to_storage(directory):
+    storage = MmapStorage(directory, 3)
+    storage.add(0, 1)
+    storage.add(1, 2)
+
+
+def test_mmap_storage(directory):
+    storage = MmapStorage(directory, 3)
+    storage.add(0, 1)
+    storage.add(2, 0.5)
+    assert storage.collect() == [1.0, 0.0, 0.5]
+
+    processes = [
+        Process(target=add_to_storage, args=(directory, )) for _ in range(2)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(os.listdir(directory)) == 3
+    assert storage.collect() == [3.0, 4.0, 0.5]
+
+
+def test_mmap_storage_ignores_foreign_files(directory):
+    MmapStorage(directory, 2).add(0, 1)
+    assert MmapStorage(directory, 3).collect() == [0.0, 0.0, 0.0]
+
+
+class TestMetrics(object):
+    @pytest.mark.parametrize('multiprocess', [False, True])
+    def test_observe(self, directory, multiprocess):
+        metrics = Metrics(directory=directory if multiprocess else None)
+        metrics.observe('csrf', 'accepted', {'unmask': 0.00003, 'compare': 2})
+        metrics.observe('csrf', 'mismatch', {'unmask': 0.00001})
+        metrics.observe('form', 'valid', {'parse': 0.2})
+        lines = metrics.render().splitlines()
+        assert 'relief_csrf_checks_total{outcome="accepted"} 1.0' in lines
+        assert 'relief_csrf_checks_total{outcome="mismatch"} 1.0' in lines
+        assert 'relief_csrf_checks_total{outcome="exempt"} 0.0' in lines
+        assert 'relief_form_submissions_total{outcome="valid"} 1.0' in lines
+
+        prefix = 'relief_csrf_stage_seconds_bucket{stage="unmask",le="%r"} '
+        assert prefix % BUCKETS[0] + '1.0' in lines
+        assert prefix % BUCKETS[1] + '1.0' in lines
+        assert prefix % BUCKETS[2] + '2.0' in lines
+        assert 'relief_csrf_stage_seconds_count{stage="unmask"} 2.0' in lines
+        assert 'relief_csrf_stage_seconds_sum{stage="unmask"} %r' % (
+            0.00003 + 0.00001
+        ) in lines
+        assert (
+            'relief_csrf_stage_seconds_bucket{stage="compare",le="1.0"} 0.0'
+            in lines
+        )
+        assert (
+            'relief_csrf_stage_seconds_bucket{stage="compare",le="+Inf"} 1.0'
+            in lines
+        )
+        assert 'relief_form_stage_seconds_count{stage="parse"} 1.0' in lines
@@ -0,0 +1,191 @@
+# coding: utf-8
+"""
+    tests.test_middleware
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+import flask
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+try:
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+except ImportError:
+    from werkzeug.wsgi import DispatcherMiddleware
+
+from flask.ext.relief import Relief
+from flask.ext.relief.middleware import CSRFMiddleware
+
+
+class BoundRelief(Relief):
+    def get_csrf_binding(self):
+        return flask.request.remote_addr
+
+
+@pytest.fixture
+def dispatched(app):
+    dispatched = []
+
+    @app.before_request
+    def count():
+        dispatched.append(flask.request.path)
+
+    @app.route('/', methods=['GET', 'POST'])
+    def index():
+        if flask.request.method == 'GET':
+            return flask.render_template_string(u'{{ csrf_token }}')
+        return u'success'
+
+    return dispatched
+
+
+@pytest.mark.parametrize('config', [
+    'RELIEF_CSRF_STATELESS', 'RELIEF_CSRF_DOUBLE_SUBMIT', None
+])
+def test_middleware(app, dispatched, config):
+    kwargs = {}
+    if config is not None:
+        app.config[config] = True
+    if config == 'RELIEF_CSRF_STATELESS':
+        BoundRelief(app)
+        kwargs['binding'] = lambda environ: environ['REMOTE_ADDR']
+    else:
+        Relief(app)
+    app.wsgi_app = CSRFMiddleware.from_app(app.wsgi_app, app, **kwargs)
+
+    with app.test_client() as client:
+        csrf_token = client.get('/').data
+        del dispatched[:]
+
+        with client.post('/') as response:
+            assert response.status_code == 400
+        with client.post('/', data={'csrf_token': u'a' * 84}) as response:
+            assert response.status_code == 400
+        headers = {'X-RELIEF-CSRF-Token': u'a' * 84}
+        with client.post('/', headers=headers) as response:
+            assert response.status_code == 400
+        assert dispatched == []
+
+        with client.post('/', data={'csrf_token': csrf_token}) as response:
+            assert response.status_code == 200
+        headers = {'X-RELIEF-CSRF-Token': csrf_token}
+        with client.post('/', headers=headers) as response:
+            assert response.status_code == 200
+        assert dispatched == ['/', '/']
+
+
+def test_middleware_stateless_without_binding(app):
+    with pytest.raises(ValueError):
+        CSRFMiddleware(app.wsgi_app, b'secret', stateless=True)
+
+
+def test_middleware_without_session(app, dispatched):
+    Relief(app)
+    app.wsgi_app = CSRFMiddleware.from_app(app.wsgi_app, app)
+    with app.test_client() as client:
+        with client.post('/', data={'csrf_token': u'foo'}) as response:
+            assert response.status_code == 400
+    assert dispatched == []
+
+
+def test_middleware_undecided(app, dispatched):
+    Relief(app)
+    app.wsgi_app = CSRFMiddleware.from_app(
+        app.wsgi_app, app, streaming_limit=16
+    )
+    with app.test_client() as client:
+        csrf_token = client.get('/').data
+        data = b'foo=' + b'a' * 100 + b'&csrf_token=' + csrf_token
+        content_type = 'application/x-www-form-urlencoded'
+        with client.post('/', data=data, content_type=content_type) as response:
+            assert response.status_code == 200
+    assert dispatched == ['/', '/']
+
+
+def test_middleware_exempt_paths(app, dispatched):
+    Relief(app)
+    app.wsgi_app = CSRFMiddleware.from_app(
+        app.wsgi_app, app, exempt_paths=['/']
+    )
+    with app.test_client() as client:
+        with client.post('/') as response:
+            assert response.status_code == 400
+    assert dispatched == ['/']
+
+
+def test_middleware_policies(app, dispatched):
+    extension = Relief(app)
+
+    @app.route('/webhook', methods=['POST'])
+    @extension.exempt
+    def webhook():
+        return u'success'
+
+    @app.route('/header', methods=['POST'])
+    @extension.csrf_policy('header-only')
+    def header():
+        return u'success'
+
+    app.wsgi_app = CSRFMiddleware.from_app(app.wsgi_app, app)
+    with app.test_client() as client:
+        with client.post('/webhook') as response:
+            assert response.status_code == 200
+        with client.post('/header') as response:
+            assert response.status_code == 400
+        with client.post('/') as response:
+            assert response.status_code == 400
+    # Requests to endpoints with a policy other than the default are left to
+    # Relief.
+    assert dispatched == ['/webhook', '/header']
+
+
+@pytest.mark.parametrize(('origin_check', 'origin', 'status_code'), [
+    ('allow', 'https://trusted.example', 200),
+    ('allow', 'https://evil.example', 400),
+    ('strict', 'https://evil.example', 400)
+])
+def test_middleware_origin_check(app, dispatched, origin_check, origin,
+                                 status_code):
+    app.config['RELIEF_CSRF_ORIGIN_CHECK'] = origin_check
+    app.config['RELIEF_CSRF_TRUSTED_ORIGINS'] = ['https://trusted.example']
+    Relief(app)
+    app.wsgi_app = CSRFMiddleware.from_app(app.wsgi_app, app)
+    with app.test_client() as client:
+        csrf_token = client.get('/').data
+        del dispatched[:]
+        headers = {'Origin': origin}
+        with client.post('/', headers=headers) as response:
+            assert response.status_code == status_code
+        if origin_check == 'strict':
+            data = {'csrf_token': csrf_token}
+            with client.post('/', headers=headers, data=data) as response:
+                assert response.status_code == 400
+    assert dispatched == (['/'] if status_code == 200 else [])
+
+
+def test_middleware_dispatcher():
+    apps = []
+    for name in ['foo', 'bar']:
+        app = flask.Flask(name)
+        app.config['SECRET_KEY'] = b'secret'
+        Relief(app)
+
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            if flask.request.method == 'GET':
+                return flask.render_template_string(u'{{ csrf_token }}')
+            return flask.request.script_root
+        apps.append(app)
+
+    foo, bar = apps
+    dispatcher = DispatcherMiddleware(foo, {'/bar': bar})
+    client = Client(CSRFMiddleware(dispatcher, b'secret'), BaseResponse)
+
+    csrf_token = client.get('/').data
+    for path in ['/', '/bar/']:
+        response = client.post(path, data={'csrf_token': csrf_token})
+        assert response.status_code == 200
+        response = client.post(path, data={'csrf_token': u'a' * 84})
+        assert response.status_code == 400
@@ -0,0 +1,114 @@
+# coding: utf-8
+"""
+    tests.test_streaming
+    ~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: 2013 by Daniel Neuhäuser
+    :license: BSD, see LICENSE.rst for details
+"""
+from io import BytesIO
+
+import pytest
+from werkzeug.formparser import parse_form_data
+from werkzeug.test import EnvironBuilder
+
+from flask.ext.relief.streaming import ReplayStream, peek_form_field
+
+
+def make_environ(data, content_type=None):
+    builder = EnvironBuilder(
+        method='POST', data=data, content_type=content_type
+    )
+    return builder.get_environ()
+
+
+class TestReplayStream(object):
+    def test_read(self):
+        stream = ReplayStream(b'foo', BytesIO(b'bar'))
+        assert stream.read(2) == b'fo'
+        assert stream.read(2) == b'ob'
+        assert stream.read() == b'ar'
+
+    def test_read_all(self):
+        stream = ReplayStream(b'foo', BytesIO(b'bar'))
+        assert stream.read() == b'foobar'
+
+    def test_readline(self):
+        stream = ReplayStream(b'fo\no', BytesIO(b'ba\nr'))
+        assert stream.readline() == b'fo\n'
+        assert stream.readline() == b'oba\n'
+        assert stream.readline(0) == b''
+        assert stream.readline(1) == b'r'
+        assert stream.readline() == b''
+
+    def test_readline_size(self):
+        stream = ReplayStream(b'foo\n', BytesIO(b'bar'))
+        assert stream.readline(2) == b'fo'
+        assert stream.readline(5) == b'o\n'
+        assert list(stream) == [b'bar']
+
+
+class TestPeekFormField(object):
+    @pytest.mark.parametrize('data', [
+        b'csrf_token=foo&bar=baz',
+        b'bar=baz&csrf_token=foo',
+        b'bar=baz&csrf_token=foo&spam=eggs',
+        b'bar=no_csrf_token=1&csrf_token=foo'
+    ])
+    def test_urlencoded(self, data):
+        environ = make_environ(
+            data, content_type='application/x-www-form-urlencoded'
+        )
+        assert peek_form_field(environ, 'csrf_token') == u'foo'
+        assert environ['wsgi.input'].read() == data
+
+    def test_urlencoded_beyond_limit(self):
+        data = b'bar=' + b'a' * 100 + b'&csrf_token=foo'
+        environ = make_environ(
+            data, content_type='application/x-www-form-urlencoded'
+        )
+        assert peek_form_field(environ, 'csrf_token', limit=50) is None
+        assert environ['wsgi.input'].read() == data
+
+    def test_multipart(self):
+        body = (
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="csrf_token"\r\n\r\n'
+            b'foo\r\n'
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="upload"; '
+            b'filename="a.txt"\r\n\r\n' +
+            b'a' * 10000 + b'\r\n'
+            b'--boundary--\r\n'
+        )
+        environ = make_environ(
+            body, content_type='multipart/form-data; boundary=boundary'
+        )
+        assert peek_form_field(environ, 'csrf_token', chunk_size=64) == u'foo'
+        # Only the beginning of the body has been read.
+        assert len(environ['wsgi.input'].prefix) < 256
+        _, form, files = parse_form_data(environ)
+        assert form['csrf_token'] == u'foo'
+        assert files['upload'].read() == b'a' * 10000
+
+    def test_multipart_not_first(self):
+        body = (
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="foo"\r\n\r\n'
+            b'bar\r\n'
+            b'--boundary\r\n'
+            b'Content-Disposition: form-data; name="csrf_token"\r\n\r\n'
+            b'foo\r\n'
+            b'--boundary--\r\n'
+        )
+        environ = make_environ(
+            body, content_type='multipart/form-data; boundary=boundary'
+        )
+        assert peek_form_field(environ, 'csrf_token') is None
+        _, form, _ = parse_form_data(environ)
+        assert form['csrf_token'] == u'foo'
+
+    def test_other_content_type(self):
+        environ = make_environ(b'csrf_token=foo', content_type='text/plain')
+        assert peek_form_field(environ, 'csrf_token') is None
+        assert environ['wsgi.input'].read() == b'csrf_token=foo'